@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+'''
+Measures how long ingesting a synthetic library takes with the two-phase
+ingest of the plugin and with setting every property at once. RhythmDB is
+replaced by a stub which only stores the properties so the results show
+the cost of the plugin's own work and the number of entry_set calls each
+phase makes. In Rhythmbox every one of those calls is much more expensive.
+
+Usage: bench_ingest.py [number of tracks]
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from euterpeapi import build_track_url, with_token  # noqa: E402
+from euterpecatalogue import (  # noqa: E402
+    parse_tracks,
+    primary_fields,
+    secondary_fields,
+)
+from euterpeindex import SearchIndex  # noqa: E402
+from euterpesynthetic import synthetic_payload  # noqa: E402
+
+DEFAULT_TRACKS = 500000
+
+REMOTE_URL = 'https://euterpe.invalid'
+TOKEN = 'benchmark-token'
+
+
+class StubDB(object):
+    '''
+    StubDB has the few RhythmDB methods used while ingesting.
+    '''
+
+    def __init__(self):
+        self.entries = {}
+        self.set_calls = 0
+
+    def entry_new(self, location):
+        entry = {}
+        self.entries[location] = entry
+        return entry
+
+    def entry_lookup_by_location(self, location):
+        return self.entries.get(location)
+
+    def entry_set(self, entry, prop, value):
+        self.set_calls += 1
+        entry[prop] = value
+
+
+def add_track(db, item, hydration):
+    track_url = build_track_url(REMOTE_URL, item['id'])
+    entry = db.entry_lookup_by_location(track_url)
+    if entry is None:
+        entry = db.entry_new(track_url)
+        db.entry_set(entry, 'MOUNTPOINT', with_token(track_url, TOKEN))
+        for name, value in primary_fields(item):
+            db.entry_set(entry, name, value)
+        db.entry_set(entry, 'LAST_SEEN', 1)
+        if hydration is not None:
+            hydration[track_url] = item
+
+    return track_url
+
+
+def hydrate_track(db, index, track_url, item):
+    index.add(track_url, item['title'], item['artist'], item['album'])
+    entry = db.entry_lookup_by_location(track_url)
+    for name, value in secondary_fields(item, REMOTE_URL, TOKEN):
+        db.entry_set(entry, name, value)
+
+
+def two_phase(tracks):
+    db = StubDB()
+    index = SearchIndex()
+    hydration = {}
+
+    started = time.monotonic()
+    for item in tracks:
+        add_track(db, item, hydration)
+    usable = time.monotonic() - started
+    usable_calls = db.set_calls
+
+    for track_url, item in hydration.items():
+        hydrate_track(db, index, track_url, item)
+    total = time.monotonic() - started
+
+    return usable, usable_calls, total, db.set_calls
+
+
+def single_phase(tracks):
+    db = StubDB()
+    index = SearchIndex()
+
+    started = time.monotonic()
+    for item in tracks:
+        track_url = add_track(db, item, None)
+        hydrate_track(db, index, track_url, item)
+    total = time.monotonic() - started
+
+    return total, total, db.set_calls
+
+
+def main():
+    count = DEFAULT_TRACKS
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    tracks = parse_tracks(synthetic_payload(count))
+    print('Tracks: {}'.format(len(tracks)))
+
+    usable, usable_calls, total, calls = two_phase(tracks)
+    print('{:<14} usable after {:>8.3f}s ({:>8} entry_set calls)  '
+          'total {:>8.3f}s ({:>8} calls)'.format(
+              'two phases', usable, usable_calls, total, calls))
+
+    single_usable, single_total, single_calls = single_phase(tracks)
+    print('{:<14} usable after {:>8.3f}s ({:>8} entry_set calls)  '
+          'total {:>8.3f}s ({:>8} calls)'.format(
+              'single phase', single_usable, single_calls, single_total,
+              single_calls))
+
+    print('The list is usable {:.1f}% sooner with {:.1f}% fewer entry_set '
+          'calls before it'.format(
+              100 * (1 - usable / single_usable),
+              100 * (1 - usable_calls / single_calls),
+          ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+'''
+Measures the memory and time needed for decoding a synthetic /v1/search/
+response with plain json.loads and with the deduplicating parse_tracks.
+
+Usage: bench_parse_memory.py [number of tracks]
+'''
+
+import os
+import sys
+import gc
+import json
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from euterpecatalogue import parse_tracks  # noqa: E402
+from euterpesynthetic import synthetic_payload  # noqa: E402
+
+DEFAULT_TRACKS = 100000
+
+
+def measure(name, parse, payload):
+    gc.collect()
+    tracemalloc.start()
+    started = time.monotonic()
+    tracks = parse(payload)
+    elapsed = time.monotonic() - started
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('{:<14} {:>8} tracks {:>8.3f}s  peak {:>8.1f} MiB  '
+          'retained {:>8.1f} MiB'.format(
+              name, len(tracks), elapsed, peak / 2**20, retained / 2**20))
+
+    del tracks
+    return peak, retained
+
+
+def main():
+    count = DEFAULT_TRACKS
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    payload = synthetic_payload(count)
+    print('Payload size: {:.1f} MiB'.format(len(payload) / 2**20))
+
+    plain_peak, plain_retained = measure('json.loads', json.loads, payload)
+    pool_peak, pool_retained = measure('parse_tracks', parse_tracks, payload)
+
+    print('Peak memory saved: {:.1f}%, retained memory saved: {:.1f}%'.format(
+        100 * (1 - pool_peak / plain_peak),
+        100 * (1 - pool_retained / plain_retained),
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,37 @@
 #!/usr/bin/env python3
 
 import json
+import time
 import gettext
 import urllib.parse
 import os.path
 
-from euterpeloader import Loader
+from collections import OrderedDict
+
+from euterpeloader import Loader, REQUEST_BACKGROUND, bandwidth
+from euterpeindex import SearchIndex, fold
+from euterpecatalogue import (
+    load_snapshot,
+    parse_tracks,
+    payload_digest,
+    primary_fields,
+    save_snapshot,
+    secondary_fields,
+)
+from euterpeclient import Login
+from euterpeapi import (
+    DEFAULT_SERVER,
+    ENDPOINT_BROWSE,
+    ENDPOINT_PROBE,
+    ENDPOINT_SEARCH,
+    auth_headers,
+    build_API_URL,
+    build_track_url,
+    cache_file_name,
+    track_ids,
+    with_token,
+)
+from euterpepriority import PlayHistory, prioritize, saved_queue_locations
 from gi.repository import GObject, RB, Peas, GLib, Gtk, GdkPixbuf
 
 gettext.install('rhythmbox', RB.locale_dir())
@@ -21,17 +47,8 @@ class EuterpePlugin(GObject.Object, Peas.Activatable):
         print("Activating Euterpe plugin")
 
         shell = self.object
-        db = shell.props.db
-        entry_type = EuterpeEntryType()
-        db.register_entry_type(entry_type)
-
-        model = RB.RhythmDBQueryModel.new_empty(db)
-        self.source = GObject.new(EuterpeSource,
-                                  shell=shell,
-                                  name=("Euterpe"),
-                                  plugin=self,
-                                  query_model=model,
-                                  entry_type=entry_type)
+        self.sources = []
+        self.merged_source = None
 
         self.icon = None
         icon_path = os.path.join(
@@ -46,25 +63,189 @@ class EuterpePlugin(GObject.Object, Peas.Activatable):
                 width,
                 height,
             )
-            self.source.set_property("icon", icon)
             self.icon = icon
 
-        group = RB.DisplayPageGroup.get_by_id("library")
-        shell.append_display_page(self.source, group)
-        shell.register_entry_type_for_source(self.source, entry_type)
+        for server_id in configured_servers():
+            self.add_source(server_id)
+
+        if merged_view_enabled():
+            self.add_merged_source()
+
+        player = shell.props.shell_player
+        self.player_handlers = [
+            player.connect('playing-song-changed', self.playback_state_cb),
+            player.connect('playing-changed', self.playback_state_cb),
+        ]
 
     def do_deactivate(self):
         print("Deactivating Euterpe plugin")
 
-        self.source.delete_thyself()
-        del self.source
+        player = self.object.props.shell_player
+        for handler in self.player_handlers:
+            player.disconnect(handler)
+        del self.player_handlers
+        bandwidth.set_stream(None)
+
+        if self.merged_source is not None:
+            self.merged_source.cleanup()
+            self.merged_source.delete_thyself()
+        del self.merged_source
+
+        for source in self.sources:
+            source.cancel_request()
+            source.cancel_ingest()
+            source.cancel_hydration()
+            source.delete_thyself()
+        del self.sources
 
         del self.icon
 
+    def add_source(self, server_id):
+        '''
+        Creates and shows the source for the server with the given ID.
+        Every server has its own entry type, credentials and search index.
+        '''
+        shell = self.object
+        db = shell.props.db
+        entry_type = EuterpeEntryType(server_id)
+        db.register_entry_type(entry_type)
+
+        model = RB.RhythmDBQueryModel.new_empty(db)
+        source = GObject.new(EuterpeSource,
+                             shell=shell,
+                             name=("Euterpe"),
+                             plugin=self,
+                             query_model=model,
+                             entry_type=entry_type,
+                             server_id=server_id)
+
+        if self.icon is not None:
+            source.set_property("icon", self.icon)
+
+        group = RB.DisplayPageGroup.get_by_id("library")
+        shell.append_display_page(source, group)
+        shell.register_entry_type_for_source(source, entry_type)
+
+        source.load_auth_data()
+        source.update_name()
+        self.sources.append(source)
+        return source
+
+    def add_server(self):
+        '''
+        Adds a source for a new server and shows its login screen. The
+        server is stored in the plugin's data file once logged in.
+        '''
+        server_ids = [source.props.server_id for source in self.sources]
+        number = len(server_ids) + 1
+        while '{}-{}'.format(DEFAULT_SERVER, number) in server_ids:
+            number += 1
+
+        source = self.add_source('{}-{}'.format(DEFAULT_SERVER, number))
+        self.object.props.display_page_tree.select(source)
+
+    def remove_server(self, source):
+        '''
+        Removes the source of a server which is not the default one.
+        '''
+        if source.props.server_id == DEFAULT_SERVER:
+            return
+
+        self.sources.remove(source)
+        source.delete_thyself()
+        self.server_synced(source)
+
+    def sync_all(self):
+        '''
+        Starts syncing all servers at the same time. Their requests share
+        the same HTTP session.
+        '''
+        for source in self.sources:
+            if not source.user_logged_in():
+                continue
+            source.measure_latency()
+            source.load_upstream_data()
+
+    def server_synced(self, source):
+        '''
+        Called by a source after it has finished loading the tracks of
+        its server.
+        '''
+        if self.merged_source is not None:
+            self.merged_source.schedule_update(source)
+
+    def set_merged_view(self, enabled):
+        '''
+        Shows or hides the view which merges the tracks of all servers
+        and remembers the choice in the plugin's data file.
+        '''
+        store_merged_view(enabled)
+
+        if enabled and self.merged_source is None:
+            self.add_merged_source()
+        elif not enabled and self.merged_source is not None:
+            self.merged_source.cleanup()
+            self.merged_source.delete_thyself()
+            self.merged_source = None
+
+        for source in self.sources:
+            source.update_merge_button(enabled)
+
+    def add_merged_source(self):
+        shell = self.object
+        db = shell.props.db
+        entry_type = EuterpeMergedEntryType()
+        db.register_entry_type(entry_type)
+
+        model = RB.RhythmDBQueryModel.new_empty(db)
+        source = GObject.new(EuterpeMergedSource,
+                             shell=shell,
+                             name=("Euterpe (all servers)"),
+                             plugin=self,
+                             query_model=model,
+                             entry_type=entry_type)
+        entry_type.source = source
+
+        if self.icon is not None:
+            source.set_property("icon", self.icon)
+
+        group = RB.DisplayPageGroup.get_by_id("library")
+        shell.append_display_page(source, group)
+        shell.register_entry_type_for_source(source, entry_type)
+
+        self.merged_source = source
+        for server_source in self.sources:
+            source.schedule_update(server_source)
+
+    def entry_types(self):
+        types = [source.props.entry_type for source in self.sources]
+        if self.merged_source is not None:
+            types.append(self.merged_source.props.entry_type)
+        return types
+
+    def playback_state_cb(self, player, data):
+        '''
+        Limits the bandwidth of background requests such as syncing while
+        a track from any Euterpe source is playing so that they do not
+        starve the audio stream.
+        '''
+        entry = player.get_playing_entry()
+        if not player.props.playing or entry is None or \
+                entry.get_entry_type() not in self.entry_types():
+            bandwidth.set_stream(None)
+            return
+
+        # RhythmDB keeps the bit rate in kbps.
+        bitrate = entry.get_ulong(RB.RhythmDBPropType.BITRATE) * 1000
+        bandwidth.set_stream(bitrate)
+
 
 class EuterpeEntryType(RB.RhythmDBEntryType):
-    def __init__(self):
-        RB.RhythmDBEntryType.__init__(self, name='euterpe-entry')
+    def __init__(self, server_id=None):
+        name = 'euterpe-entry'
+        if server_id is not None and server_id != DEFAULT_SERVER:
+            name = 'euterpe-entry-{}'.format(server_id)
+        RB.RhythmDBEntryType.__init__(self, name=name)
 
     def do_can_sync_metadata(self, entry):
         return False
@@ -73,13 +254,55 @@ class EuterpeEntryType(RB.RhythmDBEntryType):
         return entry.get_string(RB.RhythmDBPropType.MOUNTPOINT)
 
 
+class EuterpeMergedEntryType(RB.RhythmDBEntryType):
+    def __init__(self):
+        RB.RhythmDBEntryType.__init__(self, name='euterpe-merged-entry')
+        self.source = None
+
+    def do_can_sync_metadata(self, entry):
+        return False
+
+    def do_get_playback_uri(self, entry):
+        if self.source is None:
+            return None
+        return self.source.playback_uri(entry)
+
+
 class EuterpeSource(RB.BrowserSource):
+    server_id = GObject.property(type=str, default=DEFAULT_SERVER)
+
     def __init__(self, **kwargs):
         RB.BrowserSource.__init__(self, **kwargs)
         self.loader = None
         self.selected = False
         self.search_count = 1
         self.logged_in = False
+        self.sync_started = False
+        self.address_base = ""
+        self.auth_token = ""
+        self.auth_headers = {}
+        self.latency = None
+        self.merge_button = None
+        self.search_index = SearchIndex()
+        self.search_index_loaded = False
+        self.search_text = ""
+        self.search_fields = None
+        self.hydration_albums = OrderedDict()
+        self.hydration_items = {}
+        self.hydration_source_id = None
+        self.ingest_started = None
+        self.snapshot_checked = False
+        self.login = None
+        self.ingest_queue = []
+        self.ingest_position = 0
+        self.ingest_source_id = None
+        self.ingest_build_index = True
+        self.ingest_index_tag = None
+        # The digest of the library data in the database.
+        self.ingested_digest = None
+        self.snapshot_source_id = None
+        self.browser = None
+        self.play_history = None
 
     def use_auth(self, address, token=""):
         '''
@@ -88,14 +311,24 @@ class EuterpeSource(RB.BrowserSource):
         and password may be empty strings.
         '''
         self.address_base = address
-        self.auth_token = ""
-        self.auth_headers = {}
-
-        if len(token) > 0:
-            self.auth_token = token
-            self.auth_headers["Authorization"] = "Bearer {}".format(token)
+        self.auth_token = token
+        self.auth_headers = auth_headers(token)
 
         self.logged_in = True
+        self.update_name()
+
+    def update_name(self):
+        '''
+        Names the source after its server address. The default server
+        keeps the plain "Euterpe" name.
+        '''
+        if self.props.server_id == DEFAULT_SERVER:
+            return
+
+        host = urllib.parse.urlparse(self.address_base).netloc
+        if not self.logged_in or host == "":
+            host = "new server"
+        self.props.name = "Euterpe ({})".format(host)
 
     def do_selected(self):
         '''
@@ -117,12 +350,13 @@ class EuterpeSource(RB.BrowserSource):
             self.loader.cancel()
             self.loader = None
 
-    def search_tracks_api(self, http_code, data):
+    def search_tracks_api(self, http_code, data, hints):
         '''
         This functions loads 'data' into the source's database. The data is
         assumed to be a JSON with a list of tracks. It must be a list of
         tracks like the one returned from searching into the HTTPMS via its
-        REST API.
+        REST API. hints is the result of priority_hints from before the
+        request.
         '''
         if http_code == 401:
             print('Authentication with the remote server is out of date')
@@ -133,25 +367,206 @@ class EuterpeSource(RB.BrowserSource):
             print("No data in search_tracks_api callback")
             return
 
-        shell = self.props.shell
-        db = shell.props.db
-        entry_type = self.props.entry_type
+        # Nothing has to be done when the library has not changed since it
+        # was loaded from the snapshot or the previous sync.
+        digest = payload_digest(self.address_base, data)
+        if digest == self.ingested_digest:
+            print('Library on the server is unchanged')
+            if self.ingest_source_id is None:
+                self.props.load_status = RB.SourceLoadStatus.LOADED
+            return
 
-        data = data.decode('utf-8')
         try:
-            stuff = json.loads(data)
+            stuff = parse_tracks(data)
         except Exception as err:
             print('Error decoding server response: {}'.format(err))
             return
 
+        # The index is rebuilt only when the library has changed since it
+        # was stored.
+        self.ensure_search_index()
+        build_index = self.search_index.tag != digest
+
+        self.save_library_snapshot(data, digest)
+        self.ingest_tracks(stuff, build_index, digest, hints)
+
+    def ingest_tracks(self, tracks, build_index, index_tag, hints):
+        '''
+        Replaces the tracks in the source's database with tracks. The
+        tracks the user is most likely to want according to hints are
+        added right away and the rest are added in low priority batches
+        by ingest_batch_cb.
+
+        index_tag is the digest of the library data tracks were decoded
+        from. The search index is rebuilt while hydrating only when
+        build_index is True and is then stored with index_tag once all
+        tracks are hydrated.
+        '''
+        shell = self.props.shell
+        db = shell.props.db
+        entry_type = self.props.entry_type
+
+        self.cancel_ingest()
+        self.cancel_hydration()
         db.entry_delete_by_type(entry_type)
         db.commit()
+        if build_index:
+            self.search_index.clear()
+
+        self.props.load_status = RB.SourceLoadStatus.LOADING
+        self.new_model()
+        self.ingested_digest = index_tag
+
+        self.ingest_started = time.monotonic()
+        tracks, prioritized = self.prioritize_tracks(tracks, hints)
+
+        self.ingest_queue = tracks
+        self.ingest_position = 0
+        self.ingest_build_index = build_index
+        self.ingest_index_tag = index_tag
+
+        self.ingest_batch(db, max(prioritized, INGEST_BATCH_SIZE))
+        print('First {} of {} tracks ({} prioritized) added in {:.3f}s'.format(
+            self.ingest_position, len(tracks), prioritized,
+            time.monotonic() - self.ingest_started))
 
-        for item in stuff:
+        if self.ingest_position < len(self.ingest_queue):
+            self.ingest_source_id = GLib.idle_add(
+                self.ingest_batch_cb,
+                priority=GLib.PRIORITY_LOW,
+            )
+        else:
+            self.ingest_done()
+
+    def ingest_batch(self, db, size):
+        entry_type = self.props.entry_type
+        end = min(self.ingest_position + size, len(self.ingest_queue))
+        for item in self.ingest_queue[self.ingest_position:end]:
             self.add_track(db, entry_type, item)
+        self.ingest_position = end
+        db.commit()
+        self.schedule_hydration()
+
+    def ingest_batch_cb(self):
+        db = self.props.shell.props.db
+        self.ingest_batch(db, INGEST_BATCH_SIZE)
 
+        if self.ingest_position < len(self.ingest_queue):
+            return True
+
+        self.ingest_source_id = None
+        self.ingest_done()
+        return False
+
+    def ingest_done(self):
+        print('Ingest of {} tracks done in {:.3f}s'.format(
+            len(self.ingest_queue), time.monotonic() - self.ingest_started))
+
+        self.ingest_queue = []
+        self.ingest_position = 0
         self.props.load_status = RB.SourceLoadStatus.LOADED
 
+        if not self.hydration_items:
+            self.sync_done()
+        elif self.search_text:
+            self.apply_search(self.search_text)
+
+    def sync_done(self):
+        '''
+        Called once all tracks are added and hydrated, which is also when
+        the search index is complete.
+        '''
+        if self.ingest_build_index:
+            self.search_index.tag = self.ingest_index_tag
+            self.save_search_index()
+            self.ingest_build_index = False
+
+        self.props.plugin.server_synced(self)
+
+        if self.search_text:
+            self.apply_search(self.search_text)
+
+    def cancel_ingest(self):
+        if self.snapshot_source_id is not None:
+            GLib.source_remove(self.snapshot_source_id)
+            self.snapshot_source_id = None
+
+        if self.ingest_source_id is not None:
+            GLib.source_remove(self.ingest_source_id)
+            self.ingest_source_id = None
+            # The database has only part of the library.
+            self.ingested_digest = None
+
+        self.ingest_queue = []
+        self.ingest_position = 0
+
+    def priority_hints(self):
+        '''
+        Returns what the user is doing right now which tells which tracks
+        they want soon: the IDs of the tracks in the play queue and
+        the albums and artists selected in the browser. It must be called
+        before the source's entries are deleted as that clears both.
+        '''
+        hints = {
+            'queued': self.queued_ids(),
+            'albums': [],
+            'artists': [],
+        }
+
+        if self.browser is not None:
+            hints['albums'] = self.browser_selection(
+                RB.RhythmDBPropType.ALBUM)
+            hints['artists'] = self.browser_selection(
+                RB.RhythmDBPropType.ARTIST)
+
+        return hints
+
+    def queued_ids(self):
+        '''
+        Returns the set of IDs of this source's tracks in the play queue.
+        Right after start the queue has none of them as they are not in
+        the database yet. Then the queue which Rhythmbox saved in its
+        playlists file is used.
+        '''
+        entry_type = self.props.entry_type
+        queued = set()
+
+        model = self.props.shell.props.queue_source.props.query_model
+        tree_iter = model.get_iter_first()
+        while tree_iter is not None:
+            entry = model.iter_to_entry(tree_iter)
+            if entry is not None and entry.get_entry_type() == entry_type:
+                queued.add(entry.get_string(RB.RhythmDBPropType.LOCATION))
+            tree_iter = model.iter_next(tree_iter)
+
+        if not queued:
+            data_dir = RB.user_data_dir()
+            if data_dir is not None:
+                queued = saved_queue_locations(
+                    os.path.join(data_dir, "playlists.xml"))
+
+        return track_ids(self.address_base, queued)
+
+    def prioritize_tracks(self, tracks, hints):
+        '''
+        Orders tracks by how likely the user is to want them soon. Tracks
+        from the play queue, albums and artists selected in the browser
+        and recently played albums come first.
+        '''
+        return prioritize(
+            tracks,
+            self.get_play_history(),
+            hints['queued'],
+            hints['albums'],
+            hints['artists'],
+        )
+
+    def browser_selection(self, prop):
+        view = self.browser.get_property_view(prop)
+        if view is None:
+            return []
+        return view.get_selection() or []
+
     def setup(self):
         '''
         This function loads the plugin initial view. It is responsible
@@ -196,12 +611,13 @@ class EuterpeSource(RB.BrowserSource):
         self.login_button = self.builder.get_object("login_button")
 
         self.login_win.show()
-        self.load_auth_data()
 
-        if self.user_logged_in():
-            self.load_upstream_data()
-        else:
+        if not self.user_logged_in():
             self.show_login_screen()
+        elif self.sync_started:
+            self.login_win.hide()
+        else:
+            self.load_upstream_data()
 
         self.bind_settings_dynamic()
 
@@ -242,6 +658,8 @@ class EuterpeSource(RB.BrowserSource):
                 break
             break
 
+        self.browser = browser
+
         print('Binding settings')
         self.bind_settings(
             self.saved_entry_view,
@@ -255,36 +673,31 @@ class EuterpeSource(RB.BrowserSource):
         Adds the Sync and Logout buttons to the source menu, next to the
         search bar.
         '''
-        source_toolbar = None
-        for gch in self.grid.get_children():
-            if isinstance(gch, RB.SourceToolbar):
-                source_toolbar = gch
-                break
-
-        if source_toolbar is None:
-            print('Unable to add menu buttons: RB.SourceToolbar was not found')
-            return
-
-        toolbar = None
-        for tch in source_toolbar.get_children():
-            if isinstance(tch, Gtk.Toolbar):
-                toolbar = tch
-                break
-
+        toolbar = find_toolbar(self.grid)
         if toolbar is None:
-            print('Unable to add menu buttons: Gtk.Toolbar was not found')
             return
 
         logout = Gtk.ToolButton.new(None, "Logout")
         sync = Gtk.ToolButton.new(None, "Sync")
+        add_server = Gtk.ToolButton.new(None, "Add Server")
+        merge = Gtk.ToggleToolButton.new()
+        merge.set_label("Merged View")
+        merge.set_active(self.props.plugin.merged_source is not None)
         sync.connect('clicked', self.sync_clicked_cb)
         logout.connect('clicked', self.logout_clicked_cb)
+        add_server.connect('clicked', self.add_server_clicked_cb)
+        merge.connect('toggled', self.merge_toggled_cb)
+        self.merge_button = merge
 
         toolbar.add(sync)
         toolbar.add(logout)
+        toolbar.add(add_server)
+        toolbar.add(merge)
 
         logout.show()
         sync.show()
+        add_server.show()
+        merge.show()
 
     def sync_clicked_cb(self, btn):
         '''
@@ -294,29 +707,63 @@ class EuterpeSource(RB.BrowserSource):
         '''
         self.load_upstream_data()
 
+    def add_server_clicked_cb(self, btn):
+        self.props.plugin.add_server()
+
+    def merge_toggled_cb(self, btn):
+        if btn.get_active() == (self.props.plugin.merged_source is not None):
+            return
+        self.props.plugin.set_merged_view(btn.get_active())
+
+    def update_merge_button(self, enabled):
+        if self.merge_button is not None:
+            self.merge_button.set_active(enabled)
+
     def logout_clicked_cb(self, btn):
         '''
         Executed when the logout button is pressed. The method clears the
         source database, removes the stored credentials and shows the login
-        page.
+        page. Sources of servers other than the default one are removed
+        altogether.
         '''
-        self.store_auth_data("", "")
+        self.clear_login()
+        self.props.plugin.remove_server(self)
+
+    def clear_login(self):
+        self.cancel_request()
+        self.remove_auth_data()
         self.logged_in = False
-        self.login_entry_address.set_text("")
-        self.login_entry_user.set_text("")
-        self.login_entry_pass.set_text("")
+        self.sync_started = False
+        self.update_name()
 
-        self.show_login_screen()
+        if self.selected:
+            self.login_entry_address.set_text("")
+            self.login_entry_user.set_text("")
+            self.login_entry_pass.set_text("")
+            self.show_login_screen()
 
         db = self.props.shell.props.db
         entry_type = self.props.entry_type
         db.entry_delete_by_type(entry_type)
         db.commit()
 
+        self.cancel_ingest()
+        self.cancel_hydration()
+        self.search_index.clear()
+        self.search_index_loaded = True
+        self.save_search_index()
+        self.remove_library_snapshot()
+        self.snapshot_checked = False
+        self.ingested_digest = None
+
+        # Takes the tracks of this server out of the merged view.
+        self.props.plugin.server_synced(self)
+
     def force_logout(self):
         server_address = self.address_base
-        self.logout_clicked_cb(None)
-        self.login_entry_address.set_text(server_address)
+        self.clear_login()
+        if self.selected:
+            self.login_entry_address.set_text(server_address)
 
     def show_login_screen(self):
         '''
@@ -331,44 +778,45 @@ class EuterpeSource(RB.BrowserSource):
         Makes a request to the upstream server and gets all the data for
         tracks. Then loads them into the source's database.
         '''
-        self.login_win.hide()
+        if self.selected:
+            self.login_win.hide()
+        self.sync_started = True
         self.props.load_status = RB.SourceLoadStatus.LOADING
-        self.new_model()
 
         self.cancel_request()
-        search_url = self.build_API_URL(self.address_base, ENDPOINT_SEARCH)
+        hints = self.priority_hints()
+
+        search_url = build_API_URL(self.address_base, ENDPOINT_SEARCH)
         print("Loading HTTPMS into the database")
-        self.loader = Loader()
+        self.loader = Loader(REQUEST_BACKGROUND)
         self.loader.set_headers(self.auth_headers)
-        self.loader.get_url(search_url, self.search_tracks_api)
+        self.loader.get_url(search_url, self.search_tracks_api, hints)
+
+        # The snapshot is loaded while waiting for the server. It is
+        # skipped if the server responds first.
+        if not self.snapshot_checked:
+            self.snapshot_checked = True
+            self.snapshot_source_id = GLib.idle_add(
+                self.load_snapshot_cb,
+                hints,
+                priority=GLib.PRIORITY_LOW,
+            )
 
     def add_track(self, db, entry_type, item):
         '''
-        Adds this track to the source's database.
+        Adds this track to the source's database. Only the properties
+        needed for browsing and playback are set here. Everything else,
+        including adding it to the search index, is queued for
+        hydrate_track.
         '''
 
         # track_url is the canonical unique URL for this track.
-        track_url = self.build_API_URL(
-            self.address_base,
-            ENDPOINT_FILE.format(item['id']),
-        )
+        track_url = build_track_url(self.address_base, item['id'])
 
         # play_url is the URL at which this track can be loaded.
         # Sometimes this can be different from track_url. For
         # example when the URL includes a token or basic auth.
-        play_url = self.build_API_URL(
-            self.address_base,
-            ENDPOINT_FILE.format(item['id']),
-        )
-
-        album_url = self.build_API_URL(
-            self.address_base,
-            ENDPOINT_ALBUM_ART.format(item['album_id']),
-        )
-
-        if len(self.auth_token) > 0:
-            play_url = '{}?token={}'.format(play_url, self.auth_token)
-            album_url = '{}?token={}'.format(album_url, self.auth_token)
+        play_url = with_token(track_url, self.auth_token)
 
         entry = db.entry_lookup_by_location(track_url)
         if entry:
@@ -380,33 +828,167 @@ class EuterpeSource(RB.BrowserSource):
         else:
             entry = RB.RhythmDBEntry.new(db, entry_type, track_url)
             db.entry_set(entry, RB.RhythmDBPropType.MOUNTPOINT, play_url)
-            db.entry_set(entry, RB.RhythmDBPropType.ARTIST, item['artist'])
-            db.entry_set(entry, RB.RhythmDBPropType.TITLE, item['title'])
-            db.entry_set(entry, RB.RhythmDBPropType.ALBUM, item['album'])
-            db.entry_set(entry, RB.RhythmDBPropType.ALBUM_SORTNAME,
-                         str(item['album_id']))
-            db.entry_set(entry, RB.RhythmDBPropType.ALBUM_SORT_KEY,
-                         item['album_id'])
-            db.entry_set(entry, RB.RhythmDBPropType.COMMENT,
-                         '{}'.format(item['format']))
-            db.entry_set(entry, RB.RhythmDBPropType.TRACK_NUMBER,
-                         item['track'])
-            db.entry_set(entry, RB.RhythmDBPropType.MB_ALBUMID,
-                         album_url)
+            for name, value in primary_fields(item):
+                db.entry_set(entry, getattr(RB.RhythmDBPropType, name), value)
             db.entry_set(entry, RB.RhythmDBPropType.LAST_SEEN,
                          self.search_count)
-            if item['duration'] > 0:
-                db.entry_set(entry, RB.RhythmDBPropType.DURATION,
-                             item['duration'] / 1000)
+
+            self.hydration_items[track_url] = item
+            album_tracks = self.hydration_albums.setdefault(
+                item['album_id'], [])
+            album_tracks.append(track_url)
+
+    def hydrate_track(self, db, track_url):
+        '''
+        Sets the secondary metadata of an already added track. Returns
+        False if the track was not waiting for hydration.
+        '''
+        item = self.hydration_items.pop(track_url, None)
+        if item is None:
+            return False
+
+        if self.ingest_build_index:
+            self.search_index.add(
+                track_url,
+                item['title'],
+                item['artist'],
+                item['album'],
+            )
+
+        entry = db.entry_lookup_by_location(track_url)
+        if entry is None:
+            return False
+
+        for name, value in secondary_fields(
+                item, self.address_base, self.auth_token):
+            db.entry_set(entry, getattr(RB.RhythmDBPropType, name), value)
+
+        return True
+
+    def schedule_hydration(self):
+        '''
+        Starts hydrating the tracks added by add_track in low priority
+        batches so that the UI stays responsive while doing it. It runs
+        below the ingest batches so that it does not slow them down.
+        '''
+        if self.hydration_source_id is not None or not self.hydration_items:
+            return
+
+        self.hydration_source_id = GLib.idle_add(
+            self.hydrate_batch_cb,
+            priority=HYDRATION_PRIORITY,
+        )
+
+    def cancel_hydration(self):
+        if self.hydration_source_id is not None:
+            GLib.source_remove(self.hydration_source_id)
+            self.hydration_source_id = None
+
+        self.hydration_albums.clear()
+        self.hydration_items.clear()
+
+    def hydrate_batch_cb(self):
+        '''
+        Hydrates at most HYDRATION_BATCH_SIZE tracks. Albums which are
+        currently visible in the entry view are hydrated first.
+        '''
+        db = self.props.shell.props.db
+        hydrated = 0
+
+        for album_id in self.visible_albums():
+            album_tracks = self.hydration_albums.pop(album_id, [])
+            for track_url in album_tracks:
+                self.hydrate_track(db, track_url)
+            hydrated += len(album_tracks)
+
+        while hydrated < HYDRATION_BATCH_SIZE and self.hydration_albums:
+            _, album_tracks = self.hydration_albums.popitem(last=False)
+            for track_url in album_tracks:
+                self.hydrate_track(db, track_url)
+            hydrated += len(album_tracks)
 
         db.commit()
 
+        if self.hydration_albums:
+            return True
+
+        self.hydration_items.clear()
+        self.hydration_source_id = None
+
+        # More tracks may still be coming. They schedule hydration again.
+        if self.ingest_source_id is not None:
+            return False
+
+        if self.ingest_started is not None:
+            print('Metadata hydration done {:.3f}s after ingest start'.format(
+                time.monotonic() - self.ingest_started))
+        self.sync_done()
+        return False
+
+    def visible_albums(self):
+        '''
+        Returns the album IDs of the tracks which are currently shown
+        in the entry view and are still waiting for hydration.
+        '''
+        if not self.hydration_items:
+            return []
+
+        tree_view = self.entry_tree_view()
+        if tree_view is None:
+            return []
+
+        visible = tree_view.get_visible_range()
+        model = tree_view.get_model()
+        if visible is None or model is None:
+            return []
+
+        start, end = visible
+        albums = []
+        path = start.copy()
+        while path.compare(end) <= 0:
+            tree_iter = model.get_iter(path)
+            entry = model.iter_to_entry(tree_iter)
+            item = None
+            if entry is not None:
+                item = self.hydration_items.get(
+                    entry.get_string(RB.RhythmDBPropType.LOCATION))
+            if item is not None and item['album_id'] not in albums:
+                albums.append(item['album_id'])
+            path.next()
+
+        return albums
+
+    def entry_tree_view(self):
+        '''
+        Returns the Gtk.TreeView which is wrapped by the source's entry
+        view or None if it could not be found.
+        '''
+        entry_view = self.get_entry_view()
+        if entry_view is None:
+            return None
+
+        pending = [entry_view]
+        while pending:
+            widget = pending.pop()
+            if isinstance(widget, Gtk.TreeView):
+                return widget
+            if isinstance(widget, Gtk.Container):
+                pending.extend(widget.get_children())
+
+        return None
+
     def new_model(self):
+        self.search_count = self.search_count + 1
+        self.props.query_model = self.full_model()
+
+    def full_model(self):
+        '''
+        Returns a query model with all tracks from the latest sync.
+        '''
         shell = self.props.shell
         entry_type = self.props.entry_type
         db = shell.props.db
 
-        self.search_count = self.search_count + 1
         q = GLib.PtrArray()
         db.query_append_params(q, RB.RhythmDBQueryType.EQUALS,
                                RB.RhythmDBPropType.TYPE, entry_type)
@@ -419,20 +1001,53 @@ class EuterpeSource(RB.BrowserSource):
         model = RB.RhythmDBQueryModel.new_for_entry_type(db, entry_type, False)
 
         db.do_full_query_async_parsed(model, q)
-        self.props.query_model = model
+        return model
 
-    def build_API_URL(self, remote_url, endpoint):
-        parsed = urllib.parse.urlparse(remote_url)
+    def do_search(self, search, cur_text, new_text):
+        '''
+        Executed when the text in the source's search bar changes. The
+        search is done with the source's own index instead of RhythmDB's
+        property matching which is too slow for large libraries.
+        '''
+        new_text = (new_text or "").strip()
+        search_prop = None
+        if search is not None:
+            search_prop = getattr(search.props, 'search_prop', None)
+        fields = SEARCH_FIELDS.get(search_prop)
+        if new_text == self.search_text and fields == self.search_fields:
+            return
+        self.search_text = new_text
+        self.search_fields = fields
+        self.apply_search(new_text)
 
-        # If the remote URL is an domain or a sub-domain without a path
-        # component such as https://music.example.com
-        if parsed.path == "":
-            return urllib.parse.urljoin(remote_url, endpoint)
+    def apply_search(self, text):
+        '''
+        Replaces the source's query model with one which contains only
+        the tracks matching text. An empty text restores the full model.
+        '''
+        if not text:
+            self.props.query_model = self.full_model()
+            return
 
-        if not remote_url.endswith("/"):
-            remote_url = remote_url + "/"
+        found = self.search_index.search(
+            text,
+            self.search_fields,
+            SEARCH_MAX_RESULTS + 1,
+        )
+        if len(found) > SEARCH_MAX_RESULTS:
+            print('Showing only the first {} results for "{}"'.format(
+                SEARCH_MAX_RESULTS, text))
+            del found[SEARCH_MAX_RESULTS:]
 
-        return urllib.parse.urljoin(remote_url, endpoint.lstrip("/"))
+        db = self.props.shell.props.db
+        model = RB.RhythmDBQueryModel.new_empty(db)
+        for location in found:
+            entry = db.entry_lookup_by_location(location)
+            if entry is None:
+                continue
+            model.add_entry(entry, -1)
+
+        self.props.query_model = model
 
     def playing_entry_changed_cb(self, player, entry):
         '''
@@ -444,15 +1059,55 @@ class EuterpeSource(RB.BrowserSource):
         if entry.get_entry_type() != self.props.entry_type:
             return
 
-        au = entry.get_string(RB.RhythmDBPropType.MB_ALBUMID)
-        if au:
-            key = RB.ExtDBKey.create_storage(
-                "title", entry.get_string(RB.RhythmDBPropType.TITLE))
-            key.add_field("artist", entry.get_string(
-                RB.RhythmDBPropType.ARTIST))
-            key.add_field("album", entry.get_string(
-                RB.RhythmDBPropType.ALBUM))
-            self.art_store.store_uri(key, RB.ExtDBSourceType.EMBEDDED, au)
+        db = self.props.shell.props.db
+        location = entry.get_string(RB.RhythmDBPropType.LOCATION)
+        if self.hydrate_track(db, location):
+            db.commit()
+
+        store_album_art(self.art_store, entry)
+
+        history = self.get_play_history()
+        history.played(entry.get_string(RB.RhythmDBPropType.ALBUM_SORTNAME))
+        file_name = self.cache_file_name("history")
+        if file_name is not None:
+            history.save(file_name)
+
+    def get_play_history(self):
+        '''
+        Returns the albums play history of this source, loading it from
+        the cache directory on first use.
+        '''
+        if self.play_history is not None:
+            return self.play_history
+
+        self.play_history = PlayHistory()
+        file_name = self.cache_file_name("history")
+        if file_name is not None:
+            self.play_history.load(file_name)
+        return self.play_history
+
+    def measure_latency(self):
+        '''
+        Makes a small request to the server and remembers how long it
+        took. The merged view plays tracks from the server with the
+        lowest latency.
+        '''
+        probe_url = build_API_URL(self.address_base, ENDPOINT_PROBE)
+        loader = Loader()
+        loader.set_headers(self.auth_headers)
+        loader.get_url(probe_url, self.measure_latency_cb, loader)
+
+    def measure_latency_cb(self, http_code, data, loader):
+        if data is None or loader.latency is None:
+            print('Measuring latency of {} failed'.format(self.address_base))
+            return
+
+        if self.latency is None:
+            self.latency = loader.latency
+        else:
+            self.latency = 0.7 * self.latency + 0.3 * loader.latency
+        print('Latency of {}: {:.0f}ms'.format(
+            self.address_base, self.latency * 1000))
 
     def login_button_clicked_cb(self, data):
         '''
@@ -478,7 +1133,7 @@ class EuterpeSource(RB.BrowserSource):
             self.try_authenticated(remote_url)
             return
 
-        browse_url = self.build_API_URL(remote_url, ENDPOINT_BROWSE)
+        browse_url = build_API_URL(remote_url, ENDPOINT_BROWSE)
 
         print('Trying HTTPMS server at {}'.format(browse_url))
         loader = Loader()
@@ -526,82 +1181,24 @@ class EuterpeSource(RB.BrowserSource):
         username = self.login_entry_user.get_text().strip()
         password = self.login_entry_pass.get_text()
 
-        login_token_url = self.build_API_URL(remote_url, ENDPOINT_LOGIN)
-        print("making auth request to {}".format(login_token_url))
+        self.login = Login(remote_url, username, password)
+        self.login.start(self.login_done_cb, remote_url)
 
-        loader = Loader()
-        loader.post_url(
-            login_token_url,
-            self.try_auth_credentials_callback,
-            "application/json",
-            bytes(json.dumps({
-                'username': username,
-                'password': password,
-            }), 'utf-8'),
-            remote_url,
-        )
-
-    def try_auth_credentials_callback(self, http_code, data, remote_url):
+    def login_done_cb(self, token, remote_url):
         '''
-        This callback is called from the request which tries the server
-        address and auth credentials. If they are OK data will not be a
-        None. In this case the credentials are stored and the server data
-        is loaded into the source's database.
+        Called when logging in with the address and auth credentials from
+        the login screen is done. If they are OK token will not be None.
+        In this case the credentials are stored and the server data is
+        loaded into the source's database.
 
         If the credentials are not OK then the login form is made active
         again so that the user can other address/credentials.
         '''
-
-        if data is None:
-            print("Authentication unsuccessful")
-            self.hide_login_loading()
-            self.failed_indicator.show()
-            return
-
-        try:
-            response = json.loads(data)
-        except Exception as err:
-            print("Wrong JSON in response for authentication: {}".format(err))
-            self.hide_login_loading()
-            self.failed_indicator.show()
-            return
-
-        if 'token' not in response:
-            print('No token in server response')
-            self.hide_login_loading()
-            self.failed_indicator.show()
-            return
-
-        token = response['token']
-        self.register_auth_token(token, remote_url)
-
-    def register_auth_token(self, token, remote_url):
-        '''
-        Sends a request to /register/token of the remote server in
-        order to activate the newly received token.
-        '''
-        register_token_url = self.build_API_URL(
-            remote_url, ENDPOINT_REGISTER_TOKEN)
-
-        register_token_url = '{}?token={}'.format(register_token_url, token)
-
-        loader = Loader()
-        loader.post_url(
-            register_token_url,
-            self.try_auth_token_callback,
-            "text/plain",
-            None,
-            remote_url,
-            token,
-        )
-
-    def try_auth_token_callback(self, http_code, data, remote_url, token):
+        self.login = None
         self.hide_login_loading()
 
-        if http_code < 200 or http_code >= 300:
-            print(
-                'Registering token with the server failed. '
-                'HTTP status code: {}'.format(http_code))
+        if token is None:
+            self.failed_indicator.show()
             return
 
         self.use_auth(remote_url, token)
@@ -640,25 +1237,13 @@ class EuterpeSource(RB.BrowserSource):
         Reads the plugin data file and tries to load its content into the
         source's memory. It looks for server address and credentials.
         '''
-        file_name = self.key_file_name()
-        if file_name is None:
-            print('Could not load the user data directory')
-            return
-
-        kf = GLib.KeyFile.new()
-
-        loaded = False
-        try:
-            loaded = kf.load_from_file(file_name, GLib.KeyFileFlags.NONE)
-        except GLib.Error as err:
-            print('Loading auth file error: {}'.format(err))
-
-        if not loaded:
+        kf = load_key_file()
+        if kf is None:
             return
 
         try:
-            address = kf.get_string("auth", "address")
-            token = kf.get_string("auth", "token")
+            address = kf.get_string(self.props.server_id, "address")
+            token = kf.get_string(self.props.server_id, "token")
             if len(address) > 0:
                 self.use_auth(address, token)
         except GLib.Error as err:
@@ -667,47 +1252,619 @@ class EuterpeSource(RB.BrowserSource):
     def store_auth_data(self, address, token):
         '''
         Stores the provided server address and auth credentials in the
-        plugin's data file.
+        plugin's data file. The data for other servers in the file is
+        preserved.
         '''
-        file_name = self.key_file_name()
-        if file_name is None:
-            print('Could not load the user data directory')
-            return
+        kf = load_key_file()
+        if kf is None:
+            kf = GLib.KeyFile.new()
 
-        kf = GLib.KeyFile.new()
-        kf.set_string("auth", "address", address)
-        kf.set_string("auth", "token", token)
+        group = self.props.server_id
+        kf.set_string(group, "address", address)
+        kf.set_string(group, "token", token)
 
         # The next two are left here in order to remove any left-overs
         # from the time when the username and password were stored in
         # the ini file.
-        kf.set_string("auth", "username", "")
-        kf.set_string("auth", "password", "")
+        kf.set_string(group, "username", "")
+        kf.set_string(group, "password", "")
+
+        save_key_file(kf)
+
+    def remove_auth_data(self):
+        '''
+        Removes the server address and auth credentials of this source
+        from the plugin's data file.
+        '''
+        if self.props.server_id == DEFAULT_SERVER:
+            self.store_auth_data("", "")
+            return
+
+        kf = load_key_file()
+        if kf is None:
+            return
 
         try:
-            kf.save_to_file(file_name)
-        except GLib.Error as err:
-            print('Saving auth data to file: {}'.format(err))
+            kf.remove_group(self.props.server_id)
+        except GLib.Error:
+            return
+
+        save_key_file(kf)
+
+    def index_file_name(self):
+        '''
+        Returns the name (on the file system) of the file in which the
+        search index is stored between runs of the plugin.
+        '''
+        return self.cache_file_name("index")
+
+    def snapshot_file_name(self):
+        '''
+        Returns the name (on the file system) of the file in which the
+        library of the server is stored between runs of the plugin.
+        '''
+        return self.cache_file_name("library")
+
+    def cache_file_name(self, kind):
+        cache_dir = RB.user_cache_dir()
+        if cache_dir is None:
+            return None
+
+        return cache_file_name(cache_dir, self.props.server_id, kind)
+
+    def ensure_search_index(self):
+        '''
+        Loads the search index stored by a previous run unless it was
+        already loaded.
+        '''
+        if self.search_index_loaded:
+            return
+        self.search_index_loaded = True
+        self.load_search_index()
+
+    def load_search_index(self):
+        file_name = self.index_file_name()
+        if file_name is None:
+            print('Could not load the user cache directory')
+            return
+
+        if self.search_index.load(file_name):
+            print('Loaded search index with {} tracks'.format(
+                len(self.search_index)))
+
+    def save_search_index(self):
+        file_name = self.index_file_name()
+        if file_name is None:
+            print('Could not load the user cache directory')
+            return
+
+        self.search_index.save(file_name)
+
+    def save_library_snapshot(self, data, digest):
+        '''
+        Stores data, the server response with all tracks, so that the
+        library can be shown right away on the next start. Returns the
+        snapshot header or None on error.
+        '''
+        file_name = self.snapshot_file_name()
+        if file_name is None:
+            print('Could not load the user cache directory')
+            return None
+
+        return save_snapshot(file_name, self.address_base, data, digest)
+
+    def load_library_snapshot(self, hints):
+        '''
+        Loads the library stored by the last sync into the source's
+        database. The stored search index is used when it was built
+        from the same snapshot. hints are passed to ingest_tracks.
+        '''
+        file_name = self.snapshot_file_name()
+        if file_name is None:
+            print('Could not load the user cache directory')
+            return
+
+        header, data = load_snapshot(file_name)
+        if header is None:
+            return
+
+        if header.get('address') != self.address_base:
+            print('Ignoring library snapshot for {}'.format(
+                header.get('address')))
+            return
+
+        try:
+            tracks = parse_tracks(data)
+        except Exception as err:
+            print('Error decoding library snapshot: {}'.format(err))
+            return
+
+        self.ensure_search_index()
+        build_index = self.search_index.tag != header['digest']
+
+        print('Loading {} tracks from the library snapshot'.format(
+            len(tracks)))
+        self.ingest_tracks(tracks, build_index, header['digest'], hints)
+
+    def load_snapshot_cb(self, hints):
+        self.snapshot_source_id = None
+        self.load_library_snapshot(hints)
+        return False
+
+    def remove_library_snapshot(self):
+        file_name = self.snapshot_file_name()
+        if file_name is None or not os.path.exists(file_name):
+            return
+
+        try:
+            os.remove(file_name)
+        except OSError as err:
+            print('Removing library snapshot error: {}'.format(err))
 
-    def key_file_name(self):
+
+class EuterpeMergedSource(RB.BrowserSource):
+    '''
+    EuterpeMergedSource shows the tracks of all servers together. Tracks
+    which are present on more than one server are shown once and are
+    played from the server with the lowest measured latency.
+    '''
+
+    def __init__(self, **kwargs):
+        RB.BrowserSource.__init__(self, **kwargs)
+        self.selected = False
+        # Maps the location of every merged entry to a dict with the
+        # location of the same track in each source which has it.
+        self.candidates = {}
+        # The locations of the merged entries each source has tracks for.
+        self.source_keys = {}
+        self.pending_updates = []
+        self.update_source = None
+        self.update_entries = []
+        self.update_position = 0
+        self.update_keys = set()
+        self.update_stale = []
+        self.update_source_id = None
+        self.model_ready = False
+        self.art_store = RB.ExtDB(name="album-art")
+
+    def do_selected(self):
+        if self.selected:
+            return
+        self.selected = True
+
+        self.props.show_browser = True
+        self.get_entry_view().props.sort_order = "Track,ascending"
+
+        for child in self.get_children():
+            self.grid = child
+
+        toolbar = find_toolbar(self.grid)
+        if toolbar is not None:
+            sync = Gtk.ToolButton.new(None, "Sync")
+            sync.connect('clicked', self.sync_clicked_cb)
+            toolbar.add(sync)
+            sync.show()
+
+        player = self.props.shell.props.shell_player
+        player.connect('playing-song-changed', self.playing_entry_changed_cb)
+
+        self.props.plugin.sync_all()
+
+    def cleanup(self):
+        '''
+        Removes the merged entries from the database. Must be called
+        before the source is deleted.
+        '''
+        if self.update_source_id is not None:
+            GLib.source_remove(self.update_source_id)
+            self.update_source_id = None
+        self.pending_updates = []
+        self.update_source = None
+        self.update_entries = []
+        self.update_keys = set()
+        self.update_stale = []
+
+        db = self.props.shell.props.db
+        db.entry_delete_by_type(self.props.entry_type)
+        db.commit()
+        self.candidates = {}
+        self.source_keys = {}
+
+    def sync_clicked_cb(self, btn):
+        self.props.plugin.sync_all()
+
+    def schedule_update(self, source):
+        '''
+        Queues updating the merged entries with the tracks of source. It
+        is done in low priority batches so that the UI stays responsive.
+        A source which was logged out or removed has all of its tracks
+        taken out of the merged view.
+        '''
+        if not self.model_ready:
+            self.model_ready = True
+            self.props.query_model = self.full_model()
+
+        if source not in self.pending_updates:
+            self.pending_updates.append(source)
+
+        if self.update_source_id is not None:
+            return
+
+        self.update_source_id = GLib.idle_add(
+            self.update_batch_cb,
+            priority=GLib.PRIORITY_LOW,
+        )
+
+    def full_model(self):
+        shell = self.props.shell
+        entry_type = self.props.entry_type
+        db = shell.props.db
+
+        q = GLib.PtrArray()
+        db.query_append_params(q, RB.RhythmDBQueryType.EQUALS,
+                               RB.RhythmDBPropType.TYPE, entry_type)
+        model = RB.RhythmDBQueryModel.new_for_entry_type(db, entry_type, False)
+        db.do_full_query_async_parsed(model, q)
+        return model
+
+    def start_update(self, db, source):
+        plugin = self.props.plugin
+        self.update_source = source
+        self.update_entries = []
+        self.update_position = 0
+        self.update_keys = set()
+        self.update_stale = []
+
+        if source in plugin.sources and source.user_logged_in():
+            db.entry_foreach_by_type(
+                source.props.entry_type,
+                lambda entry, *args: self.update_entries.append(entry),
+                None,
+            )
+
+    def update_batch_cb(self):
         '''
-        Returns the name (on the file system) of the plugin's data
-        file. This file is used to store settings between different
-        runs of the plugin.
+        Handles at most INGEST_BATCH_SIZE tracks of the source which is
+        being updated. Its tracks are added to the merged view first.
+        Then the merged entries for which the source no longer has a track
+        lose it as a candidate and are removed when no source has them.
         '''
-        data_dir = RB.user_data_dir()
-        if data_dir is None:
+        db = self.props.shell.props.db
+
+        if self.update_source is None:
+            if not self.pending_updates:
+                self.update_source_id = None
+                return False
+            self.start_update(db, self.pending_updates.pop(0))
+
+        source = self.update_source
+        end = self.update_position + INGEST_BATCH_SIZE
+
+        if self.update_position < len(self.update_entries):
+            for server_entry in self.update_entries[self.update_position:end]:
+                self.add_candidate(db, source, server_entry)
+            self.update_position = end
+
+            if self.update_position >= len(self.update_entries):
+                self.update_entries = []
+                self.update_stale = list(
+                    self.source_keys.get(source, set()) - self.update_keys)
+                self.update_position = 0
+        else:
+            stale = self.update_stale[:INGEST_BATCH_SIZE]
+            del self.update_stale[:INGEST_BATCH_SIZE]
+            for location in stale:
+                self.remove_candidate(db, source, location)
+
+            if not self.update_stale:
+                if self.update_keys:
+                    self.source_keys[source] = self.update_keys
+                else:
+                    self.source_keys.pop(source, None)
+                self.update_keys = set()
+                self.update_source = None
+                print('Merged view has {} unique tracks'.format(
+                    len(self.candidates)))
+
+        db.commit()
+        return True
+
+    def add_candidate(self, db, source, server_entry):
+        location = MERGED_LOCATION_PREFIX + urllib.parse.quote(
+            '\x1f'.join(merge_key(server_entry)))
+
+        candidates = self.candidates.get(location)
+        if candidates is None:
+            candidates = {}
+            self.candidates[location] = candidates
+            RB.RhythmDBEntry.new(db, self.props.entry_type, location)
+
+        candidates[source] = server_entry.get_string(
+            RB.RhythmDBPropType.LOCATION)
+        self.update_keys.add(location)
+        self.refresh_merged_entry(db, location)
+
+    def remove_candidate(self, db, source, location):
+        candidates = self.candidates.get(location)
+        if candidates is None:
+            return
+
+        candidates.pop(source, None)
+        if candidates:
+            self.refresh_merged_entry(db, location)
+            return
+
+        del self.candidates[location]
+        entry = db.entry_lookup_by_location(location)
+        if entry is not None:
+            db.entry_delete(entry)
+
+    def refresh_merged_entry(self, db, location):
+        '''
+        Copies the properties of the track from the server which would be
+        used for playing it to its merged entry. Only changed properties
+        are set.
+        '''
+        entry = db.entry_lookup_by_location(location)
+        server_entry = self.best_candidate(db, location)
+        if entry is None or server_entry is None:
+            return
+
+        for prop in MERGED_STRING_PROPS:
+            value = server_entry.get_string(prop) or ""
+            if value != (entry.get_string(prop) or ""):
+                db.entry_set(entry, prop, value)
+        for prop in MERGED_ULONG_PROPS:
+            value = server_entry.get_ulong(prop)
+            if value != entry.get_ulong(prop):
+                db.entry_set(entry, prop, value)
+
+    def best_candidate(self, db, location):
+        '''
+        Returns the entry of the track with the merged location on the
+        server with the lowest latency out of those which have it, or
+        None. Servers which were logged out or removed since the merged
+        view was updated are skipped.
+        '''
+        sources = self.props.plugin.sources
+        candidates = self.candidates.get(location, {})
+
+        def latency(candidate):
+            source = candidate[0]
+            if source.latency is None:
+                return float('inf')
+            return source.latency
+
+        for source, server_location in sorted(candidates.items(),
+                                              key=latency):
+            if source not in sources or not source.user_logged_in():
+                continue
+            server_entry = db.entry_lookup_by_location(server_location)
+            if server_entry is not None:
+                return server_entry
+
+        return None
+
+    def playback_uri(self, entry):
+        '''
+        Returns the URL of the track on the server picked by
+        best_candidate.
+        '''
+        db = self.props.shell.props.db
+        server_entry = self.best_candidate(
+            db, entry.get_string(RB.RhythmDBPropType.LOCATION))
+        if server_entry is None:
             return None
+        return server_entry.get_string(RB.RhythmDBPropType.MOUNTPOINT)
+
+    def playing_entry_changed_cb(self, player, entry):
+        if not entry:
+            return
+        if entry.get_entry_type() != self.props.entry_type:
+            return
 
-        return os.path.join(data_dir, "euterpe.auth")
+        # The artwork comes from the same server as the played track.
+        db = self.props.shell.props.db
+        server_entry = self.best_candidate(
+            db, entry.get_string(RB.RhythmDBPropType.LOCATION))
+        if server_entry is None:
+            return
+        store_album_art(
+            self.art_store,
+            entry,
+            server_entry.get_string(RB.RhythmDBPropType.MB_ALBUMID),
+        )
+
+
+def merge_key(entry):
+    '''
+    Returns the key by which tracks from different servers are considered
+    the same.
+    '''
+    return (
+        fold(entry.get_string(RB.RhythmDBPropType.ARTIST)),
+        fold(entry.get_string(RB.RhythmDBPropType.ALBUM)),
+        fold(entry.get_string(RB.RhythmDBPropType.TITLE)),
+        str(entry.get_ulong(RB.RhythmDBPropType.TRACK_NUMBER)),
+    )
+
+
+def store_album_art(art_store, entry, au=None):
+    '''
+    Stores the album artwork URL of entry in the album art database so
+    that it is shown for the playing track. au is used as the URL instead
+    of the one in the entry when given.
+    '''
+    if au is None:
+        au = entry.get_string(RB.RhythmDBPropType.MB_ALBUMID)
+    if au:
+        key = RB.ExtDBKey.create_storage(
+            "title", entry.get_string(RB.RhythmDBPropType.TITLE))
+        key.add_field("artist", entry.get_string(
+            RB.RhythmDBPropType.ARTIST))
+        key.add_field("album", entry.get_string(
+            RB.RhythmDBPropType.ALBUM))
+        art_store.store_uri(key, RB.ExtDBSourceType.EMBEDDED, au)
+
+
+def find_toolbar(grid):
+    '''
+    Returns the Gtk.Toolbar next to the search bar of a source or None if
+    it was not found.
+    '''
+    source_toolbar = None
+    for gch in grid.get_children():
+        if isinstance(gch, RB.SourceToolbar):
+            source_toolbar = gch
+            break
 
+    if source_toolbar is None:
+        print('Unable to add menu buttons: RB.SourceToolbar was not found')
+        return None
+
+    for tch in source_toolbar.get_children():
+        if isinstance(tch, Gtk.Toolbar):
+            return tch
+
+    print('Unable to add menu buttons: Gtk.Toolbar was not found')
+    return None
+
+
+def key_file_name():
+    '''
+    Returns the name (on the file system) of the plugin's data
+    file. This file is used to store settings between different
+    runs of the plugin.
+    '''
+    data_dir = RB.user_data_dir()
+    if data_dir is None:
+        return None
+
+    return os.path.join(data_dir, "euterpe.auth")
+
+
+def load_key_file():
+    '''
+    Returns the plugin's data file as a GLib.KeyFile or None if it could
+    not be loaded.
+    '''
+    file_name = key_file_name()
+    if file_name is None:
+        print('Could not load the user data directory')
+        return None
+
+    kf = GLib.KeyFile.new()
+
+    loaded = False
+    try:
+        loaded = kf.load_from_file(file_name, GLib.KeyFileFlags.NONE)
+    except GLib.Error as err:
+        print('Loading auth file error: {}'.format(err))
+
+    if not loaded:
+        return None
+
+    return kf
+
+
+def save_key_file(kf):
+    file_name = key_file_name()
+    if file_name is None:
+        print('Could not load the user data directory')
+        return
+
+    try:
+        kf.save_to_file(file_name)
+    except GLib.Error as err:
+        print('Saving auth data to file: {}'.format(err))
+
+
+def configured_servers():
+    '''
+    Returns the IDs of all servers in the plugin's data file. The default
+    server is always first, even when it is not configured yet.
+    '''
+    servers = [DEFAULT_SERVER]
+
+    kf = load_key_file()
+    if kf is None:
+        return servers
+
+    groups, _ = kf.get_groups()
+    for group in groups:
+        if group.startswith('{}-'.format(DEFAULT_SERVER)):
+            servers.append(group)
+
+    return servers
+
+
+def merged_view_enabled():
+    kf = load_key_file()
+    if kf is None:
+        return False
+
+    try:
+        return kf.get_boolean(GENERAL_GROUP, "merged_view")
+    except GLib.Error:
+        return False
+
+
+def store_merged_view(enabled):
+    kf = load_key_file()
+    if kf is None:
+        kf = GLib.KeyFile.new()
 
-ENDPOINT_LOGIN = '/v1/login/token/'
-ENDPOINT_REGISTER_TOKEN = '/v1/register/token/'
-ENDPOINT_SEARCH = '/v1/search/'
-ENDPOINT_FILE = '/v1/file/{}'
-ENDPOINT_ALBUM_ART = '/v1/album/{}/artwork'
-ENDPOINT_BROWSE = "/v1/browse/"
+    kf.set_boolean(GENERAL_GROUP, "merged_view", enabled)
+    save_key_file(kf)
+
+
+GENERAL_GROUP = "general"
+
+# Locations of entries in the merged view start with this.
+MERGED_LOCATION_PREFIX = "euterpe-merged:"
+
+# Properties which are copied from the server entries to the merged ones.
+MERGED_STRING_PROPS = (
+    RB.RhythmDBPropType.ARTIST,
+    RB.RhythmDBPropType.TITLE,
+    RB.RhythmDBPropType.ALBUM,
+    RB.RhythmDBPropType.GENRE,
+    RB.RhythmDBPropType.COMMENT,
+    RB.RhythmDBPropType.MB_ALBUMID,
+)
+MERGED_ULONG_PROPS = (
+    RB.RhythmDBPropType.TRACK_NUMBER,
+    RB.RhythmDBPropType.DURATION,
+    RB.RhythmDBPropType.DATE,
+    RB.RhythmDBPropType.BITRATE,
+)
+
+# The number of tracks which are hydrated with secondary metadata on
+# every idle call.
+HYDRATION_BATCH_SIZE = 500
+
+# Hydration batches run only when no ingest batch is waiting.
+HYDRATION_PRIORITY = GLib.PRIORITY_LOW + 10
+
+# The number of tracks which are added to the database on every idle call.
+# The first batch is larger when there are more prioritized tracks.
+INGEST_BATCH_SIZE = 2000
+
+# A search shows at most this many tracks. Building the query model for
+# more takes long and a longer list is not useful anyway.
+SEARCH_MAX_RESULTS = 2000
+
+# The search index fields used for every search type of the search bar.
+# Types which are not listed, such as "All", search all fields.
+SEARCH_FIELDS = {
+    RB.RhythmDBPropType.ARTIST: ('artist',),
+    RB.RhythmDBPropType.ARTIST_FOLDED: ('artist',),
+    RB.RhythmDBPropType.ALBUM: ('album',),
+    RB.RhythmDBPropType.ALBUM_FOLDED: ('album',),
+    RB.RhythmDBPropType.TITLE: ('title',),
+    RB.RhythmDBPropType.TITLE_FOLDED: ('title',),
+}
 
 
 GObject.type_register(EuterpeSource)
+GObject.type_register(EuterpeMergedSource)
@@ -0,0 +1,83 @@
+import os.path
+import urllib.parse
+
+ENDPOINT_LOGIN = '/v1/login/token/'
+ENDPOINT_REGISTER_TOKEN = '/v1/register/token/'
+ENDPOINT_SEARCH = '/v1/search/'
+ENDPOINT_FILE = '/v1/file/{}'
+ENDPOINT_ALBUM_ART = '/v1/album/{}/artwork'
+ENDPOINT_BROWSE = "/v1/browse/"
+ENDPOINT_PROBE = "/v1/browse/?by=album&per-page=1"
+
+# The key file group of the first configured server. Further servers use
+# groups named "auth-2", "auth-3" and so on.
+DEFAULT_SERVER = "auth"
+
+
+def build_API_URL(remote_url, endpoint):
+    parsed = urllib.parse.urlparse(remote_url)
+
+    # If the remote URL is an domain or a sub-domain without a path
+    # component such as https://music.example.com
+    if parsed.path == "":
+        return urllib.parse.urljoin(remote_url, endpoint)
+
+    if not remote_url.endswith("/"):
+        remote_url = remote_url + "/"
+
+    return urllib.parse.urljoin(remote_url, endpoint.lstrip("/"))
+
+
+def cache_file_name(cache_dir, server_id, kind):
+    '''
+    Returns the name of a file in cache_dir with cached data of kind
+    ("index" or "library") for the server with server_id.
+    '''
+    if server_id == DEFAULT_SERVER:
+        return os.path.join(cache_dir, "euterpe.{}".format(kind))
+    return os.path.join(cache_dir, "euterpe-{}.{}".format(server_id, kind))
+
+
+def build_track_url(remote_url, track_id):
+    '''
+    Returns the canonical unique URL of a track. It is used as location
+    of the track's RhythmDB entry.
+    '''
+    return build_API_URL(remote_url, ENDPOINT_FILE.format(track_id))
+
+
+def track_ids(remote_url, locations):
+    '''
+    Returns the set of IDs of the tracks of the server at remote_url out
+    of locations. Locations of anything else, such as local files, are
+    skipped.
+    '''
+    prefix = build_track_url(remote_url, '')
+    ids = set()
+    for location in locations:
+        if not location.startswith(prefix):
+            continue
+        track_id = location[len(prefix):]
+        if track_id.isdigit():
+            ids.add(int(track_id))
+    return ids
+
+
+def build_album_art_url(remote_url, album_id):
+    return build_API_URL(remote_url, ENDPOINT_ALBUM_ART.format(album_id))
+
+
+def with_token(url, token):
+    '''
+    Returns url with the auth token in its query, if there is one.
+    '''
+    if len(token) > 0:
+        return '{}?token={}'.format(url, token)
+    return url
+
+
+def auth_headers(token):
+    headers = {}
+    if len(token) > 0:
+        headers["Authorization"] = "Bearer {}".format(token)
+    return headers
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import hashlib
+
+from datetime import MAXYEAR, MINYEAR, date
+
+from euterpeapi import build_album_art_url, with_token
+
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Keys which every library snapshot header must have.
+SNAPSHOT_HEADER_KEYS = ('address', 'created', 'digest')
+
+
+class ValuePool(object):
+    '''
+    ValuePool makes equal strings and integers share a single object. In
+    a Euterpe catalogue the artist, album, format and most numeric fields
+    repeat for every track of an album so deduplicating them saves a lot
+    of memory for big libraries.
+    '''
+
+    def __init__(self):
+        self._strings = {}
+        self._ints = {}
+
+    def __len__(self):
+        return len(self._strings) + len(self._ints)
+
+    def share(self, value):
+        # Checking the exact type keeps True and 1 apart.
+        value_type = type(value)
+        if value_type is str:
+            return self._strings.setdefault(value, value)
+        if value_type is int:
+            return self._ints.setdefault(value, value)
+        return value
+
+    def object_hook(self, obj):
+        '''
+        json object_hook which replaces all values of obj with their
+        shared copies.
+        '''
+        share = self.share
+        for key, value in obj.items():
+            obj[key] = share(value)
+        return obj
+
+
+def parse_tracks(data, pool=None):
+    '''
+    Decodes the body of a /v1/search/ response. data may be bytes or str.
+    Repeating values in the result are deduplicated with pool which is
+    created for this call only when not given.
+    '''
+    if pool is None:
+        pool = ValuePool()
+
+    return json.loads(data, object_hook=pool.object_hook)
+
+
+def primary_fields(item):
+    '''
+    Returns (property, value) pairs with the properties of a track needed
+    for browsing it. property is the name of a RhythmDBPropType.
+    '''
+    return (
+        ('ARTIST', item['artist']),
+        ('TITLE', item['title']),
+        ('ALBUM', item['album']),
+        ('ALBUM_SORTNAME', str(item['album_id'])),
+        ('ALBUM_SORT_KEY', item['album_id']),
+        ('TRACK_NUMBER', item['track']),
+    )
+
+
+def secondary_fields(item, remote_url, token):
+    '''
+    Returns (property, value) pairs with the rest of the metadata of a
+    track from the server at remote_url. They are not needed until the
+    track is shown or played. property is the name of a RhythmDBPropType.
+    '''
+    album_url = with_token(
+        build_album_art_url(remote_url, item['album_id']),
+        token,
+    )
+
+    fields = [
+        ('COMMENT', '{}'.format(item['format'])),
+        ('MB_ALBUMID', album_url),
+    ]
+
+    if item['duration'] > 0:
+        fields.append(('DURATION', item['duration'] / 1000))
+
+    year = item.get('year', 0)
+    if year and MINYEAR <= year <= MAXYEAR:
+        # Julian days as used by GDate count from the 1st of January of
+        # year 1 exactly like date.toordinal().
+        fields.append(('DATE', date(year, 1, 1).toordinal()))
+
+    genre = item.get('genre', '')
+    if genre:
+        fields.append(('GENRE', genre))
+
+    bitrate = item.get('bitrate', 0)
+    if bitrate and bitrate > 0:
+        # The server reports bits per second while RhythmDB keeps kbps.
+        fields.append(('BITRATE', bitrate // 1000))
+
+    return fields
+
+
+def payload_digest(remote_url, data):
+    '''
+    Returns a digest which identifies data, the body of a /v1/search/
+    response from the server at remote_url. The address is part of it
+    because the track locations are built from it.
+    '''
+    digest = hashlib.sha1(remote_url.encode('utf-8'))
+    digest.update(b'\n')
+    digest.update(data)
+    return digest.hexdigest()
+
+
+def save_snapshot(file_name, remote_url, data, digest=None):
+    '''
+    Stores data, the body of a /v1/search/ response from the server at
+    remote_url, in file_name. The file starts with a one line JSON header
+    followed by data as is so that loading it later is exactly as fast
+    as decoding the server response. Returns the header.
+
+    digest is the result of payload_digest for data. It is computed when
+    not given.
+    '''
+    if digest is None:
+        digest = payload_digest(remote_url, data)
+
+    header = {
+        'version': SNAPSHOT_FORMAT_VERSION,
+        'address': remote_url,
+        'created': time.time(),
+        'digest': digest,
+    }
+
+    tmp_name = '{}.tmp'.format(file_name)
+    try:
+        with open(tmp_name, 'wb') as fh:
+            fh.write(json.dumps(header).encode('utf-8'))
+            fh.write(b'\n')
+            fh.write(data)
+        os.replace(tmp_name, file_name)
+    except OSError as err:
+        print('Saving library snapshot error: {}'.format(err))
+        return None
+
+    return header
+
+
+def load_snapshot(file_name):
+    '''
+    Reads a file written by save_snapshot. Returns a tuple with its header
+    and data or (None, None) if the file is missing or invalid.
+    '''
+    if not os.path.exists(file_name):
+        return None, None
+
+    try:
+        with open(file_name, 'rb') as fh:
+            header = json.loads(fh.readline())
+            data = fh.read()
+    except (OSError, ValueError) as err:
+        print('Loading library snapshot error: {}'.format(err))
+        return None, None
+
+    if not isinstance(header, dict) or \
+            header.get('version') != SNAPSHOT_FORMAT_VERSION:
+        print('Ignoring library snapshot with unknown format version')
+        return None, None
+
+    if any(key not in header for key in SNAPSHOT_HEADER_KEYS):
+        print('Ignoring library snapshot with an incomplete header')
+        return None, None
+
+    return header, data
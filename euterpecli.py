@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+'''
+Runs the sync pipeline of the plugin outside of Rhythmbox. It logs in to a
+Euterpe server, downloads and decodes its catalogue, builds the search
+index and reports how long each phase took and how much memory it needed.
+
+Optionally the library snapshot and search index are written in the same
+format the plugin uses. Copying them into the Rhythmbox cache directory
+(~/.cache/rhythmbox) of another machine makes the plugin show the library
+right away on its first start.
+
+Examples:
+
+    python3 euterpecli.py https://music.example.com -u alice
+    python3 euterpecli.py https://music.example.com --snapshot-dir /tmp/rb
+    python3 euterpecli.py --synthetic 500000 --trace-memory
+'''
+
+import os
+import sys
+import time
+import getpass
+import argparse
+import resource
+import tracemalloc
+
+from euterpeloader import Loader, REQUEST_BACKGROUND
+from euterpeclient import Login
+from euterpeapi import (
+    DEFAULT_SERVER,
+    ENDPOINT_SEARCH,
+    auth_headers,
+    build_API_URL,
+    build_track_url,
+    cache_file_name,
+)
+from euterpecatalogue import parse_tracks, save_snapshot
+from euterpeindex import SearchIndex
+from euterpesynthetic import synthetic_payload
+from gi.repository import GLib
+
+ENV_PASSWORD = "EUTERPE_PASSWORD"
+
+ROW_FORMAT = '{:<10} {:>9} {:>9} {:>10} {:>12} {:>9} {:>10} {:>10}'
+
+
+class Report(object):
+    '''
+    Report collects the measurements of every phase of the pipeline.
+    '''
+
+    def __init__(self, trace_memory):
+        self.phases = []
+        self.trace_memory = trace_memory
+        if trace_memory:
+            tracemalloc.start()
+
+    def start(self):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        return time.monotonic()
+
+    def add(self, name, started, size=None, count=None, latency=None):
+        elapsed = time.monotonic() - started
+        peak = None
+        if self.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+
+        self.phases.append({
+            'name': name,
+            'elapsed': elapsed,
+            'size': size,
+            'count': count,
+            'latency': latency,
+            'peak': peak,
+            'max_rss': max_rss(),
+        })
+
+    def print(self):
+        print(ROW_FORMAT.format(
+            'phase', 'time', 'latency', 'size', 'throughput', 'tracks',
+            'py peak', 'max rss'))
+
+        for phase in self.phases:
+            throughput = None
+            if phase['size'] is not None and phase['elapsed'] > 0:
+                throughput = phase['size'] / phase['elapsed']
+
+            print(ROW_FORMAT.format(
+                phase['name'],
+                format_seconds(phase['elapsed']),
+                format_seconds(phase['latency']),
+                format_bytes(phase['size']),
+                format_bytes(throughput, '/s'),
+                '-' if phase['count'] is None else phase['count'],
+                format_bytes(phase['peak']),
+                format_bytes(phase['max_rss']),
+            ))
+
+
+class Sync(object):
+    '''
+    Sync runs the network part of the pipeline in a GLib main loop. The
+    decoding and indexing are done after the loop has finished.
+    '''
+
+    def __init__(self, args, report):
+        self.args = args
+        self.report = report
+        self.token = args.token
+        self.data = None
+        self.failed = False
+        self.loop = GLib.MainLoop()
+
+    def run(self):
+        if self.args.username:
+            GLib.idle_add(self.login)
+        else:
+            GLib.idle_add(self.fetch)
+        self.loop.run()
+
+    def login(self):
+        password = os.environ.get(ENV_PASSWORD)
+        if password is None:
+            password = getpass.getpass()
+
+        self.started = self.report.start()
+        self.auth = Login(self.args.address, self.args.username, password)
+        self.auth.start(self.login_cb)
+        return False
+
+    def login_cb(self, token):
+        self.report.add(
+            'login',
+            self.started,
+            latency=sum(self.auth.latencies()),
+        )
+
+        if token is None:
+            self.fail('Logging in to {} failed'.format(self.args.address))
+            return
+
+        self.token = token
+        self.fetch()
+
+    def fetch(self):
+        search_url = build_API_URL(self.args.address, ENDPOINT_SEARCH)
+        print('Fetching {}'.format(search_url))
+
+        self.started = self.report.start()
+        self.loader = Loader(REQUEST_BACKGROUND)
+        self.loader.set_headers(auth_headers(self.token))
+        self.loader.get_url(search_url, self.fetch_cb)
+        return False
+
+    def fetch_cb(self, http_code, data):
+        if data is None:
+            self.fail('Fetching the catalogue failed. HTTP status: {}'.format(
+                http_code))
+            return
+
+        self.report.add(
+            'fetch',
+            self.started,
+            size=len(data),
+            latency=self.loader.latency,
+        )
+        self.data = data
+        self.loop.quit()
+
+    def fail(self, message):
+        print(message, file=sys.stderr)
+        self.failed = True
+        self.loop.quit()
+
+
+def max_rss():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def format_seconds(value):
+    if value is None:
+        return '-'
+    return '{:.3f}s'.format(value)
+
+
+def format_bytes(value, suffix=''):
+    if value is None:
+        return '-'
+    for unit in ('B', 'KiB', 'MiB'):
+        if value < 1024:
+            return '{:.1f}{}{}'.format(value, unit, suffix)
+        value /= 1024
+    return '{:.1f}GiB{}'.format(value, suffix)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Sync a Euterpe library without Rhythmbox and report '
+                    'the performance of each phase.',
+    )
+    parser.add_argument(
+        'address', nargs='?',
+        help='address of the Euterpe server, e.g. https://music.example.com',
+    )
+    parser.add_argument(
+        '-u', '--username',
+        help='log in with this username. The password is read from the {} '
+             'environment variable or asked for'.format(ENV_PASSWORD),
+    )
+    parser.add_argument(
+        '-t', '--token', default='',
+        help='use this already registered auth token instead of logging in',
+    )
+    parser.add_argument(
+        '--synthetic', type=int, metavar='TRACKS',
+        help='use a generated library with this many tracks instead of '
+             'fetching one from a server',
+    )
+    parser.add_argument(
+        '--snapshot-dir', metavar='DIR',
+        help='write the library snapshot and search index to this directory',
+    )
+    parser.add_argument(
+        '--server-id', default=DEFAULT_SERVER,
+        help='name the snapshot files for the server with this ID in the '
+             'plugin data file (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--trace-memory', action='store_true',
+        help='measure the peak Python memory of every phase. This makes '
+             'the whole run noticeably slower',
+    )
+
+    args = parser.parse_args()
+    if args.synthetic is None and not args.address:
+        parser.error('address is required unless --synthetic is used')
+
+    if args.address and not args.address.startswith("http://") and \
+            not args.address.startswith("https://"):
+        args.address = 'https://{}'.format(args.address)
+
+    return args
+
+
+def main():
+    args = parse_args()
+    report = Report(args.trace_memory)
+
+    if args.synthetic is not None:
+        if not args.address:
+            args.address = 'https://euterpe.invalid'
+        started = report.start()
+        data = synthetic_payload(args.synthetic)
+        report.add('generate', started, size=len(data))
+    else:
+        sync = Sync(args, report)
+        sync.run()
+        if sync.failed:
+            report.print()
+            return 1
+        data = sync.data
+
+    started = report.start()
+    try:
+        tracks = parse_tracks(data)
+    except Exception as err:
+        print('Error decoding server response: {}'.format(err),
+              file=sys.stderr)
+        return 1
+    report.add('parse', started, size=len(data), count=len(tracks))
+
+    started = report.start()
+    index = SearchIndex()
+    for item in tracks:
+        index.add(
+            build_track_url(args.address, item['id']),
+            item['title'],
+            item['artist'],
+            item['album'],
+        )
+    report.add('index', started, count=len(index))
+
+    if args.snapshot_dir:
+        started = report.start()
+        os.makedirs(args.snapshot_dir, exist_ok=True)
+        header = save_snapshot(
+            cache_file_name(args.snapshot_dir, args.server_id, "library"),
+            args.address,
+            data,
+        )
+        if header is None:
+            return 1
+        index.tag = header['digest']
+        index.save(cache_file_name(args.snapshot_dir, args.server_id, "index"))
+        report.add('snapshot', started, size=len(data))
+        print('Library snapshot written to {}'.format(args.snapshot_dir))
+
+    report.print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import json
+
+from euterpeapi import (
+    ENDPOINT_LOGIN,
+    ENDPOINT_REGISTER_TOKEN,
+    build_API_URL,
+    with_token,
+)
+from euterpeloader import Loader
+
+
+class Login(object):
+    '''
+    Login gets a new auth token from a Euterpe server with a username and
+    password and then registers it. When done `callback(token, *args)` is
+    called. token is None when logging in failed for any reason.
+    '''
+
+    def __init__(self, remote_url, username, password):
+        self.remote_url = remote_url
+        self.username = username
+        self.password = password
+        self.loaders = []
+
+    def start(self, callback, *args):
+        self.callback = callback
+        self.args = args
+
+        login_token_url = build_API_URL(self.remote_url, ENDPOINT_LOGIN)
+        print("making auth request to {}".format(login_token_url))
+
+        loader = Loader()
+        self.loaders.append(loader)
+        loader.post_url(
+            login_token_url,
+            self.credentials_cb,
+            "application/json",
+            bytes(json.dumps({
+                'username': self.username,
+                'password': self.password,
+            }), 'utf-8'),
+        )
+
+    def credentials_cb(self, http_code, data):
+        if data is None:
+            print("Authentication unsuccessful")
+            self.done(None)
+            return
+
+        try:
+            response = json.loads(data)
+        except Exception as err:
+            print("Wrong JSON in response for authentication: {}".format(err))
+            self.done(None)
+            return
+
+        if 'token' not in response:
+            print('No token in server response')
+            self.done(None)
+            return
+
+        self.register_token(response['token'])
+
+    def register_token(self, token):
+        '''
+        Sends a request to /register/token of the remote server in
+        order to activate the newly received token.
+        '''
+        register_token_url = with_token(
+            build_API_URL(self.remote_url, ENDPOINT_REGISTER_TOKEN),
+            token,
+        )
+
+        loader = Loader()
+        self.loaders.append(loader)
+        loader.post_url(
+            register_token_url,
+            self.register_token_cb,
+            "text/plain",
+            None,
+            token,
+        )
+
+    def register_token_cb(self, http_code, data, token):
+        if http_code is None or http_code < 200 or http_code >= 300:
+            print(
+                'Registering token with the server failed. '
+                'HTTP status code: {}'.format(http_code))
+            self.done(None)
+            return
+
+        self.done(token)
+
+    def done(self, token):
+        self.callback(token, *self.args)
+
+    def latencies(self):
+        '''
+        Returns the latency in seconds of every request made so far.
+        '''
+        return [loader.latency for loader in self.loaders
+                if loader.latency is not None]
@@ -0,0 +1,321 @@
+import os
+import sys
+import json
+import unicodedata
+
+from array import array
+from collections import Counter
+
+INDEX_FORMAT_VERSION = 4
+
+# The indexed fields of a track in the order in which they are stored.
+FIELDS = ('title', 'artist', 'album')
+
+# Words shorter than this can not be looked up in the trigram index. They
+# are matched against the beginnings of the indexed words instead, which
+# have posting lists of their own.
+TRIGRAM_LEN = 3
+
+# The share of the query word trigrams which a track must contain in order
+# to be considered a typo-tolerant match when there is no exact match.
+FUZZY_MIN_SHARE = 0.4
+
+# Fuzzy matching is only attempted for words with at least this many
+# trigrams. Shorter words produce too many false positives.
+FUZZY_MIN_TRIGRAMS = 3
+
+
+def fold(text):
+    '''
+    Returns text with its case and diacritics folded so that "Sigur Rós"
+    and "sigur ros" produce the same result.
+    '''
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return stripped.casefold()
+
+
+def trigrams(text):
+    '''
+    Returns the set of all three character sub-strings of text.
+    '''
+    return {text[i:i + TRIGRAM_LEN]
+            for i in range(len(text) - TRIGRAM_LEN + 1)}
+
+
+def prefixes(text):
+    '''
+    Returns the set of the beginnings of the words in text which are too
+    short to be trigrams.
+    '''
+    return {word[:size] for word in text.split()
+            for size in range(1, min(len(word), TRIGRAM_LEN - 1) + 1)}
+
+
+class SearchIndex(object):
+    '''
+    SearchIndex is an in-memory trigram index over the title, artist and
+    album of tracks. Every track is identified by its RhythmDB location.
+    Each field has its own posting lists so that a search may be limited
+    to some of them.
+
+    Posting lists are arrays of document IDs which are always appended in
+    increasing order. Removed documents are only marked as such and are
+    dropped on the next clear().
+    '''
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # tag is the digest of the library data the index was built from.
+        self.tag = None
+        self._locations = []
+        self._texts = []
+        self._ids = {}
+        self._postings = tuple({} for _ in FIELDS)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, location, title, artist, album):
+        '''
+        Indexes a track. Adding a location which is already in the index
+        replaces its previous data.
+        '''
+        self.remove(location)
+
+        texts = (fold(title), fold(artist), fold(album))
+        doc_id = len(self._texts)
+        self._locations.append(location)
+        self._texts.append(texts)
+        self._ids[location] = doc_id
+
+        for text, field_postings in zip(texts, self._postings):
+            for gram in trigrams(text) | prefixes(text):
+                postings = field_postings.get(gram)
+                if postings is None:
+                    postings = array('I')
+                    field_postings[gram] = postings
+                postings.append(doc_id)
+
+    def remove(self, location):
+        doc_id = self._ids.pop(location, None)
+        if doc_id is None:
+            return
+        self._texts[doc_id] = None
+        self._locations[doc_id] = None
+
+    def search(self, query, fields=None, limit=None):
+        '''
+        Returns the locations of the tracks which match every word in
+        query in the order in which they were added. A word matches when
+        it is a sub-string of one of fields, a sequence of names from
+        FIELDS. All fields are searched when it is None. Words shorter
+        than three characters only match the beginning of a word. Words
+        without any exact matches fall back to trigram similarity so that
+        small typos are tolerated.
+
+        At most limit locations are returned when it is not None. The
+        last and most common word stops being matched once there are
+        enough results.
+        '''
+        words = sorted(set(fold(query).split()), key=len, reverse=True)
+        if not words:
+            return []
+
+        if fields is None:
+            fields = range(len(FIELDS))
+        else:
+            fields = [FIELDS.index(name) for name in fields]
+
+        candidates = None
+        for i, word in enumerate(words):
+            word_limit = limit if i == len(words) - 1 else None
+            candidates = self._match_word(
+                word, fields, candidates, word_limit)
+            if not candidates:
+                return []
+
+        found = sorted(candidates)
+        if limit is not None:
+            found = found[:limit]
+        return [self._locations[doc_id] for doc_id in found]
+
+    def _match_word(self, word, fields, candidates, limit):
+        if len(word) < TRIGRAM_LEN:
+            matched = set()
+            for field in fields:
+                matched.update(self._collect(
+                    self._postings[field].get(word, ()),
+                    candidates,
+                    limit,
+                ))
+            return matched
+
+        grams = trigrams(word)
+        matched = set()
+        postings = []
+        for field in fields:
+            field_postings = [self._postings[field].get(gram, ())
+                              for gram in grams]
+            postings.append(field_postings)
+            rarest = min(field_postings, key=len)
+
+            # A word which is a single trigram needs no further checks.
+            check = None
+            if len(grams) > 1 or len(word) > TRIGRAM_LEN:
+                check = (word, field)
+            matched.update(self._collect(rarest, candidates, limit, check))
+
+        if matched or len(grams) < FUZZY_MIN_TRIGRAMS:
+            return matched
+
+        for field_postings in postings:
+            matched |= self._match_fuzzy(field_postings, candidates)
+        return matched
+
+    def _collect(self, postings, candidates, limit, check=None):
+        '''
+        Returns the IDs of the documents in postings which are not removed
+        and are in candidates, unless it is None. check is a tuple with a
+        word and a field which must contain it. Postings are in increasing
+        order so the first limit matches are the ones which are needed.
+        '''
+        texts = self._texts
+        matched = []
+        for doc_id in postings:
+            if candidates is not None and doc_id not in candidates:
+                continue
+            texts_of_doc = texts[doc_id]
+            if texts_of_doc is None:
+                continue
+            if check is not None and check[0] not in texts_of_doc[check[1]]:
+                continue
+            matched.append(doc_id)
+            if limit is not None and len(matched) >= limit:
+                break
+        return matched
+
+    def _match_fuzzy(self, postings, candidates):
+        needed = max(2, int(len(postings) * FUZZY_MIN_SHARE + 0.5))
+        counts = Counter()
+        for plist in postings:
+            counts.update(plist)
+
+        texts = self._texts
+        matched = {doc_id for doc_id, count in counts.items()
+                   if count >= needed and texts[doc_id] is not None}
+        if candidates is not None:
+            matched &= candidates
+        return matched
+
+    def save(self, file_name):
+        '''
+        Writes the index to file_name so that it does not have to be built
+        again on the next start. The file starts with a one line JSON
+        header followed by the raw posting lists. It holds only data so
+        that loading a file from elsewhere can not run any code.
+        '''
+        postings = []
+        offset = 0
+        for field_postings in self._postings:
+            ranges = {}
+            for gram, plist in field_postings.items():
+                ranges[gram] = (offset, len(plist))
+                offset += len(plist)
+            postings.append(ranges)
+
+        header = {
+            'version': INDEX_FORMAT_VERSION,
+            'tag': self.tag,
+            'byteorder': sys.byteorder,
+            'itemsize': array('I').itemsize,
+            'locations': self._locations,
+            'texts': self._texts,
+            'postings': postings,
+        }
+
+        tmp_name = '{}.tmp'.format(file_name)
+        try:
+            with open(tmp_name, 'wb') as fh:
+                fh.write(json.dumps(header).encode('utf-8'))
+                fh.write(b'\n')
+                for field_postings in self._postings:
+                    for plist in field_postings.values():
+                        plist.tofile(fh)
+            os.replace(tmp_name, file_name)
+        except OSError as err:
+            print('Saving search index error: {}'.format(err))
+
+    def load(self, file_name):
+        '''
+        Replaces the index content with the one stored in file_name.
+        Returns True on success. On error the index is left empty.
+        '''
+        self.clear()
+        if not os.path.exists(file_name):
+            return False
+
+        try:
+            with open(file_name, 'rb') as fh:
+                header = json.loads(fh.readline())
+                data = fh.read()
+        except (OSError, ValueError) as err:
+            print('Loading search index error: {}'.format(err))
+            return False
+
+        if not isinstance(header, dict) or \
+                header.get('version') != INDEX_FORMAT_VERSION:
+            print('Ignoring search index with unknown format version')
+            return False
+
+        if header.get('byteorder') != sys.byteorder or \
+                header.get('itemsize') != array('I').itemsize:
+            print('Ignoring search index from a different architecture')
+            return False
+
+        try:
+            self._read(header, data)
+        except (KeyError, TypeError, ValueError, IndexError) as err:
+            print('Ignoring damaged search index: {}'.format(err))
+            self.clear()
+            return False
+
+        return True
+
+    def _read(self, header, data):
+        locations = header['locations']
+        texts = [None if doc is None else tuple(doc)
+                 for doc in header['texts']]
+        if len(texts) != len(locations) or \
+                len(header['postings']) != len(FIELDS):
+            raise ValueError('wrong number of documents or fields')
+
+        for location, doc in zip(locations, texts):
+            if doc is None and location is None:
+                continue
+            if not isinstance(location, str) or len(doc) != len(FIELDS) or \
+                    not all(isinstance(text, str) for text in doc):
+                raise ValueError('invalid document')
+
+        all_postings = array('I')
+        all_postings.frombytes(data)
+
+        for field_postings, ranges in zip(self._postings,
+                                          header['postings']):
+            for gram, (offset, count) in ranges.items():
+                if offset < 0 or offset + count > len(all_postings):
+                    raise ValueError('posting list out of range')
+                postings = all_postings[offset:offset + count]
+                if count and postings[-1] >= len(texts):
+                    raise ValueError('document ID out of range')
+                field_postings[gram] = postings
+
+        self.tag = header.get('tag')
+        self._locations = locations
+        self._texts = texts
+        self._ids = {loc: doc_id for doc_id, loc in enumerate(locations)
+                     if loc is not None}
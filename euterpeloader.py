@@ -1,12 +1,57 @@
 import gi
 gi.require_version('Soup', '3.0')
 import sys
+import time
 
 from gi.repository import GObject, GLib, Gio, Soup
 from httpmsconfig import plugin_version
 
 USER_AGENT = "Euterpe-Rhythmbox-Plugin/{}".format(plugin_version)
 
+# Request classes. Interactive requests are never throttled. Background
+# ones share a bandwidth budget while a Euterpe track is being played.
+REQUEST_INTERACTIVE = "interactive"
+REQUEST_BACKGROUND = "background"
+
+# Read sizes for background responses. Smaller chunks are used while
+# throttled so that the transfer rate is smoother.
+CHUNK_SIZE = 64 * 1024
+THROTTLED_CHUNK_SIZE = 16 * 1024
+
+# The share of the estimated link capacity which background requests may
+# use while something is playing, after the stream itself is accounted for.
+BACKGROUND_SHARE = 0.5
+
+# The stream is given this many times its bit rate so that GStreamer is
+# able to refill its buffers after a hiccup.
+STREAM_HEADROOM = 2.0
+
+# Background requests are never throttled below this many bytes/s.
+MIN_BACKGROUND_RATE = 32 * 1024
+
+# Used as link capacity before anything has been measured.
+DEFAULT_CAPACITY = 512 * 1024
+
+# Used when the bit rate of the playing track is not known.
+DEFAULT_STREAM_BITRATE = 320000
+
+# Throughput is measured over windows of at least this many seconds.
+MEASURE_WINDOW = 1.0
+
+# A window in which no data arrived for this many seconds is thrown away.
+# Such a gap means the transfers were stalled or idle and not that the link
+# is slow.
+MEASURE_MAX_GAP = 5.0
+
+# Connection limits of the HTTP session shared by all servers. The per host
+# limit leaves room for a sync, a latency probe and the artwork requests of
+# a server running at the same time.
+MAX_CONNS = 16
+MAX_CONNS_PER_HOST = 4
+
+# Seconds after which idle connections are closed.
+IDLE_TIMEOUT = 60
+
 
 def call_callback(callback, status, data, args):
     try:
@@ -19,16 +64,215 @@ def call_callback(callback, status, data, args):
 loader_session = None
 
 
-class Loader(object):
+class TokenBucket(object):
+    '''
+    TokenBucket limits a transfer rate to `rate` bytes per second with
+    bursts of up to `burst` bytes. A rate of None means no limit. Tokens
+    may go negative when consumers read more than they waited for. This
+    is paid for by longer waits later.
+    '''
+
     def __init__(self):
+        self.rate = None
+        self.burst = 0
+        self.tokens = 0
+        self.updated = time.monotonic()
+
+    def set_rate(self, rate):
+        self._refill()
+        self.rate = rate
+        if rate is None:
+            self.tokens = 0
+            return
+        self.burst = max(rate / 4, THROTTLED_CHUNK_SIZE)
+        self.tokens = min(self.tokens, self.burst)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate is not None:
+            self.tokens = min(
+                self.burst,
+                self.tokens + (now - self.updated) * self.rate,
+            )
+        self.updated = now
+
+    def wait_time(self, size):
+        '''
+        Returns the number of seconds until size bytes may be read.
+        '''
+        if self.rate is None:
+            return 0
+        self._refill()
+        if self.tokens >= size:
+            return 0
+        return (size - self.tokens) / self.rate
+
+    def consume(self, size):
+        if self.rate is None:
+            return
+        self._refill()
+        self.tokens -= size
+
+
+class BandwidthScheduler(object):
+    '''
+    BandwidthScheduler decides how fast background requests may download.
+    When no Euterpe track is playing they are not limited. During playback
+    they get a share of the link capacity which is left after the stream.
+    The capacity is estimated from the measured throughput of background
+    requests: it is probed upwards while the budget is fully used, but
+    never above the last unthrottled measurement, and lowered when
+    transfers can not reach it.
+    '''
+
+    def __init__(self):
+        self.bucket = TokenBucket()
+        self.capacity = None
+        # The capacity measured while background requests were not limited.
+        self.measured_capacity = None
+        self.stream_rate = None
+        self._window_start = None
+        self._window_last = None
+        self._window_bytes = 0
+        self._window_throttled = False
+        self._transfers = 0
+
+    def set_stream(self, bitrate):
+        '''
+        Tells the scheduler that a Euterpe track with bitrate (bits per
+        second) is playing. Zero means the bit rate is unknown. None means
+        nothing is playing and background requests are not limited.
+        '''
+        if bitrate is None:
+            self.stream_rate = None
+        else:
+            self.stream_rate = (bitrate or DEFAULT_STREAM_BITRATE) / 8
+        self._window_start = None
+        self._update_rate()
+
+    def _update_rate(self):
+        if self.stream_rate is None:
+            self.bucket.set_rate(None)
+            return
+
+        capacity = self.capacity or DEFAULT_CAPACITY
+        rate = (capacity - self.stream_rate * STREAM_HEADROOM) * \
+            BACKGROUND_SHARE
+        self.bucket.set_rate(max(MIN_BACKGROUND_RATE, rate))
+
+    def throttled(self):
+        return self.bucket.rate is not None
+
+    def chunk_size(self):
+        if self.throttled():
+            return THROTTLED_CHUNK_SIZE
+        return CHUNK_SIZE
+
+    def wait_time(self, size):
+        return self.bucket.wait_time(size)
+
+    def start_transfer(self):
+        '''
+        Called when a background request starts receiving its body.
+        Windows are only open while at least one transfer is running so
+        that the time between transfers is not measured.
+        '''
+        self._transfers += 1
+        if self._window_start is None:
+            self._open_window(time.monotonic())
+
+    def end_transfer(self):
+        '''
+        Called when a background transfer is done, failed or cancelled.
+        The window is closed with the last transfer.
+        '''
+        self._transfers = max(0, self._transfers - 1)
+        if self._transfers > 0 or self._window_start is None:
+            return
+
+        if self._window_last - self._window_start >= MEASURE_WINDOW:
+            self._close_window(self._window_last)
+        else:
+            self._window_start = None
+
+    def _open_window(self, now):
+        self._window_start = now
+        self._window_last = now
+        self._window_bytes = 0
+        self._window_throttled = self.throttled()
+
+    def record(self, size):
+        '''
+        Accounts for size bytes which were just read by a background
+        request and updates the capacity estimate once per window.
+        '''
+        self.bucket.consume(size)
+
+        now = time.monotonic()
+        if self._window_start is None or \
+                now - self._window_last > MEASURE_MAX_GAP:
+            # Starts over instead of counting a stall as transfer time.
+            # The time it took this chunk to arrive is not known.
+            self._open_window(now)
+            return
+
+        self._window_bytes += size
+        self._window_last = now
+        if now - self._window_start < MEASURE_WINDOW:
+            return
+
+        self._close_window(now)
+        if self._transfers > 0:
+            self._open_window(now)
+
+    def _close_window(self, now):
+        measured = self._window_bytes / (now - self._window_start)
+        if not self._window_throttled:
+            # Nothing else was limiting the transfer so this is roughly
+            # what the link is capable of.
+            if self.measured_capacity is None:
+                self.measured_capacity = measured
+            else:
+                self.measured_capacity = 0.7 * self.measured_capacity + \
+                    0.3 * measured
+            self.capacity = self.measured_capacity
+        elif measured < 0.8 * self.bucket.rate:
+            # Could not use the whole budget. The link is congested.
+            self.capacity = (self.capacity or DEFAULT_CAPACITY) * 0.8
+        else:
+            # Using the whole budget only shows that the link is at least
+            # this fast. Probe upwards slowly but do not go above what it
+            # was seen to be capable of.
+            self.capacity = min(
+                (self.capacity or DEFAULT_CAPACITY) * 1.05,
+                self.measured_capacity or DEFAULT_CAPACITY,
+            )
+
+        self._window_start = None
+        self._update_rate()
+
+
+bandwidth = BandwidthScheduler()
+
+
+class Loader(object):
+    def __init__(self, request_class=REQUEST_INTERACTIVE):
         self.headers = {}
+        self.request_class = request_class
         global loader_session
         if loader_session is None:
-            loader_session = Soup.Session()
+            loader_session = Soup.Session(
+                max_conns=MAX_CONNS,
+                max_conns_per_host=MAX_CONNS_PER_HOST,
+                idle_timeout=IDLE_TIMEOUT,
+            )
             loader_session.props.user_agent = USER_AGENT
         self._cancel = Gio.Cancellable()
+        self.started = None
+        self.latency = None
 
     def _message_cb(self, source, result, data):
+        self._response_started()
         message = source.get_async_result_message(result)
         status = message.get_status()
         if status >= 200 and status <= 299:
@@ -41,17 +285,25 @@ class Loader(object):
         else:
             call_callback(self.callback, status, None, data)
 
+    def _response_started(self):
+        if self.started is not None:
+            self.latency = time.monotonic() - self.started
+
     def set_headers(self, headers):
         self.headers = headers
 
     def get_url(self, url, callback, *args):
         self.url = url
         self.callback = callback
+        self.started = time.monotonic()
         try:
             global loader_session
             req = Soup.Message.new("GET", url)
             for k, v in self.headers.items():
                 req.props.request_headers.append(k, v)
+            if self.request_class == REQUEST_BACKGROUND:
+                self._send_background(req, args)
+                return
             loader_session.send_and_read_async(
                 req,
                 Soup.MessagePriority.NORMAL,
@@ -63,9 +315,94 @@ class Loader(object):
             sys.excepthook(*sys.exc_info())
             callback(None, *args)
 
+    def _send_background(self, req, args):
+        '''
+        Sends req and reads its response in chunks while obeying the
+        bandwidth budget for background requests.
+        '''
+        self._chunks = []
+        loader_session.send_async(
+            req,
+            Soup.MessagePriority.LOW,
+            self._cancel,
+            self._send_cb,
+            (req, args),
+        )
+
+    def _send_cb(self, session, result, data):
+        self._response_started()
+        req, args = data
+        try:
+            stream = session.send_finish(result)
+        except GLib.Error as err:
+            print('Request to {} failed: {}'.format(self.url, err))
+            call_callback(self.callback, req.get_status(), None, args)
+            return
+
+        status = req.get_status()
+        if status < 200 or status > 299:
+            stream.close(None)
+            call_callback(self.callback, status, None, args)
+            return
+
+        bandwidth.start_transfer()
+        self._read_next(stream, req, args)
+
+    def _read_next(self, stream, req, args):
+        size = bandwidth.chunk_size()
+        wait = bandwidth.wait_time(size)
+        if wait <= 0:
+            self._read_chunk(stream, req, args, size)
+            return
+
+        GLib.timeout_add(
+            max(1, int(wait * 1000)),
+            self._read_chunk,
+            stream,
+            req,
+            args,
+            size,
+        )
+
+    def _read_chunk(self, stream, req, args, size):
+        stream.read_bytes_async(
+            size,
+            GLib.PRIORITY_LOW,
+            self._cancel,
+            self._read_cb,
+            (req, args),
+        )
+
+        # Makes sure the GLib timeout source is not repeated.
+        return False
+
+    def _read_cb(self, stream, result, data):
+        req, args = data
+        try:
+            chunk = stream.read_bytes_finish(result)
+        except GLib.Error as err:
+            print('Reading response from {} failed: {}'.format(self.url, err))
+            bandwidth.end_transfer()
+            self._chunks = []
+            call_callback(self.callback, req.get_status(), None, args)
+            return
+
+        if chunk.get_size() == 0:
+            bandwidth.end_transfer()
+            stream.close(None)
+            body = b''.join(self._chunks)
+            self._chunks = []
+            call_callback(self.callback, req.get_status(), body, args)
+            return
+
+        bandwidth.record(chunk.get_size())
+        self._chunks.append(chunk.get_data())
+        self._read_next(stream, req, args)
+
     def post_url(self, url, callback, content_type, body, *args):
         self.url = url
         self.callback = callback
+        self.started = time.monotonic()
         try:
             global loader_session
             req = Soup.Message.new("POST", url)
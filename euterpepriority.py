@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import xml.etree.ElementTree as ElementTree
+
+from euterpeindex import fold
+
+# Scores added to a track for every reason it may be wanted soon.
+SCORE_QUEUED_TRACK = 1000
+SCORE_QUEUED_ALBUM = 400
+SCORE_SELECTED = 500
+SCORE_PLAYED_LOCALLY = 300
+SCORE_PLAYED_ON_SERVER = 200
+
+# The score for playing an album halves for every this many seconds since.
+PLAYED_HALF_LIFE = 30 * 24 * 60 * 60
+
+# The play history keeps only this many of the most recently played albums.
+HISTORY_MAX_ALBUMS = 500
+
+
+class PlayHistory(object):
+    '''
+    PlayHistory remembers when each album was last played from a source.
+    RhythmDB can not be used for this as the entries are recreated on every
+    sync and lose their play statistics.
+    '''
+
+    def __init__(self):
+        self.albums = {}
+
+    def played(self, album_id, when=None):
+        if when is None:
+            when = time.time()
+        self.albums[str(album_id)] = when
+
+        if len(self.albums) > HISTORY_MAX_ALBUMS:
+            recent = sorted(self.albums.items(), key=lambda kv: kv[1])
+            self.albums = dict(recent[-HISTORY_MAX_ALBUMS:])
+
+    def last_played(self, album_id):
+        return self.albums.get(str(album_id), 0)
+
+    def load(self, file_name):
+        self.albums = {}
+        if not os.path.exists(file_name):
+            return
+
+        try:
+            with open(file_name, 'r') as fh:
+                albums = json.load(fh)
+        except (OSError, ValueError) as err:
+            print('Loading play history error: {}'.format(err))
+            return
+
+        if isinstance(albums, dict):
+            self.albums = albums
+
+    def save(self, file_name):
+        try:
+            with open(file_name, 'w') as fh:
+                json.dump(self.albums, fh)
+        except OSError as err:
+            print('Saving play history error: {}'.format(err))
+
+
+def saved_queue_locations(file_name):
+    '''
+    Returns the set of track locations in the play queue stored by
+    Rhythmbox in its playlists file.
+    '''
+    if not os.path.exists(file_name):
+        return set()
+
+    try:
+        tree = ElementTree.parse(file_name)
+    except (OSError, ElementTree.ParseError) as err:
+        print('Reading saved play queue error: {}'.format(err))
+        return set()
+
+    locations = set()
+    for playlist in tree.getroot().iter('playlist'):
+        if playlist.get('type') != 'queue':
+            continue
+        for location in playlist.iter('location'):
+            if location.text:
+                locations.add(location.text)
+
+    return locations
+
+
+def decay(played, now):
+    if not played or played <= 0:
+        return 0
+    return 0.5 ** (max(0, now - played) / PLAYED_HALF_LIFE)
+
+
+def prioritize(tracks, history, queued=(), selected_albums=(),
+               selected_artists=()):
+    '''
+    Returns the tracks reordered so that the ones the user is most likely
+    to want soon come first, and the number of such tracks. The rest keep
+    the order in which the server returned them.
+
+    queued is a set of IDs of tracks in the play queue. selected_albums
+    and selected_artists are the names selected in the library browser.
+    '''
+    now = time.time()
+    selected_albums = {fold(name) for name in selected_albums}
+    selected_artists = {fold(name) for name in selected_artists}
+
+    queued_albums = set()
+    if queued:
+        for item in tracks:
+            if item['id'] in queued:
+                queued_albums.add(item['album_id'])
+
+    # The part of the score which is the same for all tracks of an album.
+    # Computing it once per album keeps fold() out of the loop below.
+    album_scores = {}
+
+    scored = []
+    rest = []
+    for item in tracks:
+        album_id = item['album_id']
+
+        score = album_scores.get(album_id)
+        if score is None:
+            score = SCORE_PLAYED_LOCALLY * decay(
+                history.last_played(album_id), now)
+            if selected_albums and fold(item['album']) in selected_albums:
+                score += SCORE_SELECTED
+            elif selected_artists and \
+                    fold(item['artist']) in selected_artists:
+                score += SCORE_SELECTED
+            album_scores[album_id] = score
+
+        if album_id in queued_albums:
+            score += SCORE_QUEUED_ALBUM
+            if item['id'] in queued:
+                score += SCORE_QUEUED_TRACK
+
+        last_played = item.get('last_played', 0)
+        if last_played:
+            score += SCORE_PLAYED_ON_SERVER * decay(last_played, now)
+
+        if score > 0:
+            scored.append((score, item))
+        else:
+            rest.append(item)
+
+    # sort() is stable so tracks of the same album stay together.
+    scored.sort(key=lambda pair: pair[0], reverse=True)
+
+    return [item for _, item in scored] + rest, len(scored)
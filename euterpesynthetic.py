@@ -0,0 +1,64 @@
+import json
+import random
+
+# Roughly the size of an average album in a real library.
+TRACKS_PER_ALBUM = 12
+ALBUMS_PER_ARTIST = 5
+
+WORDS = (
+    "blue", "night", "river", "song", "light", "dream", "heart", "fire",
+    "stone", "rain", "city", "ghost", "summer", "winter", "road", "sky",
+    "golden", "silent", "wild", "electric", "ocean", "shadow", "morning",
+    "echo", "paper", "glass", "velvet", "northern", "lonely", "broken",
+)
+
+
+def _name(rnd, words):
+    return ' '.join(rnd.choice(WORDS).capitalize() for _ in range(words))
+
+
+def synthetic_tracks(count, seed=0):
+    '''
+    Returns a list of count track dicts in the format of the /v1/search/
+    endpoint of a Euterpe server. The result depends only on count and
+    seed so that measurements between runs are comparable.
+    '''
+    rnd = random.Random(seed)
+    tracks = []
+
+    artist = None
+    album = None
+    for track_id in range(1, count + 1):
+        idx = track_id - 1
+        if idx % TRACKS_PER_ALBUM == 0:
+            album_id = idx // TRACKS_PER_ALBUM + 1
+            if (album_id - 1) % ALBUMS_PER_ARTIST == 0:
+                artist_id = (album_id - 1) // ALBUMS_PER_ARTIST + 1
+                artist = _name(rnd, 2)
+            album = _name(rnd, 3)
+            year = rnd.randint(1960, 2024)
+            fmt = rnd.choice(("mp3", "mp3", "mp3", "flac", "ogg"))
+
+        tracks.append({
+            "id": track_id,
+            "artist_id": artist_id,
+            "artist": artist,
+            "album_id": album_id,
+            "album": album,
+            "title": _name(rnd, rnd.randint(1, 4)),
+            "track": idx % TRACKS_PER_ALBUM + 1,
+            "format": fmt,
+            "duration": rnd.randint(90, 480) * 1000,
+            "year": year,
+            "bitrate": 320000 if fmt == "mp3" else 900000,
+            "size": rnd.randint(3, 40) * 1024 * 1024,
+        })
+
+    return tracks
+
+
+def synthetic_payload(count, seed=0):
+    '''
+    Returns the bytes of a /v1/search/ response body with count tracks.
+    '''
+    return json.dumps(synthetic_tracks(count, seed)).encode('utf-8')